@@ -1,7 +1,9 @@
 import xml.etree.ElementTree as elemtree
 from datetime import datetime
-import requests, time, sys, os, re, math, json, base64, urllib, io
-import mapbox
+import requests, time, sys, os, re, math, json, base64, urllib, io, sqlite3, functools, collections, threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import mapbox, http_client
+from route_catalog import RouteCatalog
 from routemap import convert_gps, convert_pos, Mapframe, RouteMap
 
 class ApiKeyError(Exception):
@@ -19,13 +21,133 @@ class GyeonggiApiKeyError(ApiKeyError):
 class BusanApiKeyError(ApiKeyError):
     pass
 
+class SearchError(Exception):
+    # 지역별 검색 오류 모음
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(' / '.join(str(e) or type(e).__name__ for e in errors.values()))
+
 route_type_str = {0: '공용', 1: '공항', 2: '마을', 3: '간선', 4: '지선', 5: '순환', 6: '광역', 7: '인천', 8: '경기', 9: '폐지', 10: '투어',
     11: '직행', 12: '좌석', 13: '일반', 14: '광역', 15: '따복', 16: '순환', 21: '농어촌직행', 22: '농어촌좌석', 23: '농어촌', 30: '마을', 
     41: '고속', 42: '시외좌석', 43: '시외일반', 51: '공항리무진', 52: '공항좌석', 53: '공항일반',
     61: '일반', 62: '급행', 63: '좌석', 64: '심야', 65: '마을'}
 
+RouteData = collections.namedtuple('RouteData', ['route_positions', 'route_info', 'bus_stops'])
+
 cache_dir = 'cache'
 
+# 노선 조회 결과 캐시
+response_cache_enabled = True
+response_cache_file = 'responses.sqlite3'
+
+# 조회 종류별 캐시 유효 기간(초)
+response_cache_ttl = {
+    'bus_stops': 3 * 24 * 60 * 60,
+    'bus_route': 3 * 24 * 60 * 60,
+    'bus_type': 3 * 24 * 60 * 60,
+    'search': 12 * 60 * 60
+}
+
+# 노선 목록 캐시 (설정된 경우 목록에 포함된 지역은 원격 API 대신 사용)
+route_catalog_file = 'route_catalog.json'
+route_catalog = None
+
+# 노선 목록 캐시를 검색에 사용하는 기간(초), 지나면 다시 동기화할 때까지 원격 API로 검색
+route_catalog_max_age = 7 * 24 * 60 * 60
+
+# 지역별 노선 검색 제한 시간(초)
+search_deadline = {'서울': 8, '경기': 8, '부산': 12}
+
+# 버스 API 서버별 장애 상태
+circuit_breakers = {name: http_client.CircuitBreaker(name) for name in ['서울', '경기', '부산', '부산 BIMS']}
+
+# 배경 지도 타일을 동시에 불러오는 최대 작업 수
+tile_workers = 6
+
+rx_svg = re.compile(r'<svg\s.*?>(.*)</svg>', flags = re.DOTALL)
+
+def open_response_cache():
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok = True)
+    
+    db = sqlite3.connect(os.path.join(cache_dir, response_cache_file), timeout = 10)
+    db.execute('CREATE TABLE IF NOT EXISTS responses (region TEXT, endpoint TEXT, params TEXT, result TEXT, created REAL, PRIMARY KEY (region, endpoint, params))')
+    
+    return db
+
+def read_response_cache(region, endpoint, params):
+    db = open_response_cache()
+    try:
+        row = db.execute('SELECT result, created FROM responses WHERE region = ? AND endpoint = ? AND params = ?', (region, endpoint, params)).fetchone()
+    finally:
+        db.close()
+    
+    if row and time.time() - row[1] < response_cache_ttl[endpoint]:
+        return row[0]
+    return None
+
+def write_response_cache(region, endpoint, params, result):
+    db = open_response_cache()
+    try:
+        with db:
+            db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)', (region, endpoint, params, result, time.time()))
+    finally:
+        db.close()
+
+def is_cacheable(result):
+    if isinstance(result, tuple):
+        return all(x is not None for x in result)
+    return bool(result)
+
+def cached_response(region, endpoint, use_key = True):
+    # 지역, 조회 종류, 노선 ID를 키로 XML이 아닌 변환된 결과를 저장
+    # API 키는 결과에 영향을 주지 않으므로 캐시 키에서 제외
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args):
+            if not response_cache_enabled:
+                return function(*args)
+            
+            params = json.dumps(args[1:] if use_key else args, ensure_ascii = False)
+            
+            try:
+                result = read_response_cache(region, endpoint, params)
+            except sqlite3.Error:
+                result = None
+            
+            if result is not None:
+                return json.loads(result)
+            
+            result = function(*args)
+            
+            if not is_cacheable(result):
+                return result
+            
+            result = json.dumps(result, ensure_ascii = False)
+            
+            try:
+                write_response_cache(region, endpoint, params, result)
+            except sqlite3.Error:
+                pass
+            
+            return json.loads(result)
+        
+        return wrapper
+    
+    return decorator
+
+def is_server_error(response):
+    return response.status_code >= 500 or response.text.find('http://apis.data.go.kr/503.html') != -1
+
+def fetch(provider, url, params = None, timeout = None):
+    # 버스 API 요청 (재시도 및 서버 장애 시 차단)
+    response = http_client.get_with_retry(url, params = params, timeout = timeout, breaker = circuit_breakers[provider], is_retryable = is_server_error)
+    
+    if is_server_error(response):
+        raise ServerError('503 Server Unavailable')
+    
+    return response.text
+
 def convert_busan_bus_type(type_str):
     if type_str[:2] == '일반':
         return 61
@@ -51,7 +173,7 @@ def convert_type_to_region(route_type):
 def check_seoul_key_valid(key):
     params = {'serviceKey': key}
     
-    route_api_res = requests.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getStaionByRoute', params = params).text
+    route_api_res = fetch('서울', 'http://ws.bus.go.kr/api/rest/busRouteInfo/getStaionByRoute', params = params)
     route_api_tree = elemtree.fromstring(route_api_res)
 
     api_err = int(route_api_tree.find('./msgHeader/headerCd').text)
@@ -62,7 +184,7 @@ def check_seoul_key_valid(key):
 
 def check_gyeonggi_key_valid(key):
     params = {'serviceKey': key}
-    route_api_res = requests.get('http://apis.data.go.kr/6410000/busrouteservice/getBusRouteStationList', params = params, timeout = 20).text
+    route_api_res = fetch('경기', 'http://apis.data.go.kr/6410000/busrouteservice/getBusRouteStationList', params = params)
     route_api_tree = elemtree.fromstring(route_api_res)
     
     api_err = route_api_tree.find('./cmmMsgHeader/returnAuthMsg')
@@ -72,7 +194,7 @@ def check_gyeonggi_key_valid(key):
 
 def check_busan_key_valid(key):
     params = {'serviceKey': key}
-    route_api_res = requests.get('https://apis.data.go.kr/6260000/BusanBIMS/busInfoByRouteId', params = params, timeout = 20).text
+    route_api_res = fetch('부산', 'https://apis.data.go.kr/6260000/BusanBIMS/busInfoByRouteId', params = params)
     route_api_tree = elemtree.fromstring(route_api_res)
     
     api_err = route_api_tree.find('./cmmMsgHeader/returnAuthMsg')
@@ -80,11 +202,12 @@ def check_busan_key_valid(key):
         return False
     return True
 
+@cached_response('서울', 'bus_stops')
 def get_seoul_bus_stops(key, routeid):
     # 서울 버스 정류장 목록 조회
     params = {'serviceKey': key, 'busRouteId': routeid}
     
-    route_api_res = requests.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getStaionByRoute', params = params).text
+    route_api_res = fetch('서울', 'http://ws.bus.go.kr/api/rest/busRouteInfo/getStaionByRoute', params = params)
     route_api_tree = elemtree.fromstring(route_api_res)
 
     api_err = int(route_api_tree.find('./msgHeader/headerCd').text)
@@ -110,11 +233,12 @@ def get_seoul_bus_stops(key, routeid):
     
     return bus_stops
 
+@cached_response('경기', 'bus_stops')
 def get_gyeonggi_bus_stops(key, routeid):
     # 경기 버스 정류장 목록 조회
     params = {'serviceKey': key, 'routeId': routeid}
     
-    route_api_res = requests.get('http://apis.data.go.kr/6410000/busrouteservice/getBusRouteStationList', params = params, timeout = 20).text
+    route_api_res = fetch('경기', 'http://apis.data.go.kr/6410000/busrouteservice/getBusRouteStationList', params = params)
     route_api_tree = elemtree.fromstring(route_api_res)
     
     api_common_err = route_api_tree.find('./cmmMsgHeader/returnAuthMsg')
@@ -147,11 +271,12 @@ def get_gyeonggi_bus_stops(key, routeid):
     
     return bus_stops
 
+@cached_response('부산', 'bus_stops')
 def get_busan_bus_stops(key, route_id, route_bims_id):
     # 부산 버스 정류장 목록 조회
     params = {'optBusNum': route_bims_id}
     
-    route_api_res = requests.get('http://bus.busan.go.kr/busanBIMS/Ajax/busLineList.asp', params = params, timeout = 20).text
+    route_api_res = fetch('부산 BIMS', 'http://bus.busan.go.kr/busanBIMS/Ajax/busLineList.asp', params = params)
     route_api_tree = elemtree.fromstring(route_api_res)
 
     bus_stop_items = route_api_tree.findall('./line')
@@ -168,7 +293,7 @@ def get_busan_bus_stops(key, route_id, route_bims_id):
         bus_stops.append(stop)
     
     params2 = {'serviceKey': key, 'lineid': route_id}
-    route_api_res2 = requests.get('https://apis.data.go.kr/6260000/BusanBIMS/busInfoByRouteId', params = params2, timeout = 20).text
+    route_api_res2 = fetch('부산', 'https://apis.data.go.kr/6260000/BusanBIMS/busInfoByRouteId', params = params2)
     route_api_tree2 = elemtree.fromstring(route_api_res2)
     
     api_common_err = route_api_tree2.find('./cmmMsgHeader/returnAuthMsg')
@@ -183,11 +308,12 @@ def get_busan_bus_stops(key, route_id, route_bims_id):
     
     return bus_stops
 
+@cached_response('서울', 'bus_type')
 def get_seoul_bus_type(key, routeid):
     # 서울 버스 노선정보 조회
     params = {'serviceKey': key, 'busRouteId': routeid}
     
-    route_api_res = requests.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getRouteInfo', params = params).text
+    route_api_res = fetch('서울', 'http://ws.bus.go.kr/api/rest/busRouteInfo/getRouteInfo', params = params)
     route_api_tree = elemtree.fromstring(route_api_res)
 
     api_err = int(route_api_tree.find('./msgHeader/headerCd').text)
@@ -208,11 +334,12 @@ def get_seoul_bus_type(key, routeid):
     
     return route_info
 
+@cached_response('경기', 'bus_type')
 def get_gyeonggi_bus_type(key, routeid):
     # 경기 버스 노선정보 조회
     params = {'serviceKey': key, 'routeId': routeid}
     
-    route_api_res = requests.get('http://apis.data.go.kr/6410000/busrouteservice/getBusRouteInfoItem', params = params, timeout = 20).text
+    route_api_res = fetch('경기', 'http://apis.data.go.kr/6410000/busrouteservice/getBusRouteInfoItem', params = params)
     route_api_tree = elemtree.fromstring(route_api_res)
     
     api_common_err = route_api_tree.find('./cmmMsgHeader/returnAuthMsg')
@@ -234,11 +361,12 @@ def get_gyeonggi_bus_type(key, routeid):
     
     return route_info
 
+@cached_response('부산', 'bus_type')
 def get_busan_bus_type(key, route_bims_id):
     # 부산 버스 노선정보 조회
     params = {'optBusNum': route_bims_id}
     
-    route_api_res = requests.get('http://bus.busan.go.kr/busanBIMS/Ajax/busLineList.asp', params = params, timeout = 20).text
+    route_api_res = fetch('부산 BIMS', 'http://bus.busan.go.kr/busanBIMS/Ajax/busLineList.asp', params = params)
     route_api_tree = elemtree.fromstring(route_api_res)
 
     bus_stop_items = route_api_tree.findall('./line')
@@ -253,11 +381,12 @@ def get_busan_bus_type(key, route_bims_id):
     
     return route_info
 
+@cached_response('서울', 'bus_route')
 def get_seoul_bus_route(key, routeid):
     # 서울 버스 노선형상 조회
     params = {'serviceKey': key, 'busRouteId': routeid}
     
-    route_api_res = requests.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getRoutePath', params = params).text
+    route_api_res = fetch('서울', 'http://ws.bus.go.kr/api/rest/busRouteInfo/getRoutePath', params = params)
     route_api_tree = elemtree.fromstring(route_api_res)
 
     api_err = int(route_api_tree.find('./msgHeader/headerCd').text)
@@ -281,11 +410,12 @@ def get_seoul_bus_route(key, routeid):
     
     return route_positions
 
+@cached_response('경기', 'bus_route')
 def get_gyeonggi_bus_route(key, routeid):
     # 경기 버스 노선형상 조회
     params = {'serviceKey': key, 'routeId': routeid}
     
-    route_api_res = requests.get('http://apis.data.go.kr/6410000/busrouteservice/getBusRouteLineList', params = params, timeout = 20).text
+    route_api_res = fetch('경기', 'http://apis.data.go.kr/6410000/busrouteservice/getBusRouteLineList', params = params)
     route_api_tree = elemtree.fromstring(route_api_res)
     
     api_common_err = route_api_tree.find('./cmmMsgHeader/returnAuthMsg')
@@ -310,12 +440,13 @@ def get_gyeonggi_bus_route(key, routeid):
     
     return route_positions
 
+@cached_response('부산', 'bus_route', use_key = False)
 def get_busan_bus_route(route_name):
     # 부산 버스 노선형상 조회
     params = {'busLineId': route_name}
     encoded_params = urllib.parse.urlencode(params, encoding='cp949')
     
-    route_api_res = requests.get('http://bus.busan.go.kr/busanBIMS/Ajax/busLineCoordList.asp?' + encoded_params, timeout = 5).text
+    route_api_res = fetch('부산 BIMS', 'http://bus.busan.go.kr/busanBIMS/Ajax/busLineCoordList.asp?' + encoded_params, timeout = 5)
     route_api_tree = elemtree.fromstring(route_api_res)
     xml_route_positions = route_api_tree.findall('./coord')
     
@@ -333,10 +464,37 @@ def get_busan_bus_route(route_name):
     
     return route_positions, route_bims_id
 
+def load_route(key, region, route_data):
+    # 노선형상, 노선정보, 정류장 목록을 동시에 조회
+    with ThreadPoolExecutor(max_workers = 3) as executor:
+        if region == '서울':
+            route_future = executor.submit(get_seoul_bus_route, key, route_data['id'])
+            info_future = executor.submit(get_seoul_bus_type, key, route_data['id'])
+            stops_future = executor.submit(get_seoul_bus_stops, key, route_data['id'])
+        elif region == '경기':
+            route_future = executor.submit(get_gyeonggi_bus_route, key, route_data['id'])
+            info_future = executor.submit(get_gyeonggi_bus_type, key, route_data['id'])
+            stops_future = executor.submit(get_gyeonggi_bus_stops, key, route_data['id'])
+        elif region == '부산':
+            # 부산은 노선형상 조회 결과의 BIMS 노선 ID로 나머지 정보를 조회
+            route_positions, route_bims_id = get_busan_bus_route(route_data['name'])
+            if route_bims_id is None:
+                raise ValueError('부산 버스 노선형상을 찾을 수 없습니다: ' + route_data['name'])
+            
+            info_future = executor.submit(get_busan_bus_type, key, route_bims_id)
+            stops_future = executor.submit(get_busan_bus_stops, key, route_data['id'], route_bims_id)
+            
+            return RouteData(route_positions, info_future.result(), stops_future.result())
+        else:
+            raise ValueError('Unknown Region: "{}"'.format(region))
+        
+        return RouteData(route_future.result(), info_future.result(), stops_future.result())
+
+@cached_response('서울', 'search')
 def search_seoul_bus_info(key, number):
     params = {'serviceKey': key, 'strSrch': number}
     
-    list_api_res = requests.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getBusRouteList', params = params).text
+    list_api_res = fetch('서울', 'http://ws.bus.go.kr/api/rest/busRouteInfo/getBusRouteList', params = params)
     list_api_tree = elemtree.fromstring(list_api_res)
 
     api_err = int(list_api_tree.find('./msgHeader/headerCd').text)
@@ -366,114 +524,168 @@ def search_seoul_bus_info(key, number):
     
     return bus_info_list
 
+@cached_response('경기', 'search')
 def search_gyeonggi_bus_info(key, number):
     bus_info_list = []
     
-    try:
-        params = {'serviceKey': key, 'keyword': number}
-        
-        list_api_res = requests.get('http://apis.data.go.kr/6410000/busrouteservice/getBusRouteList', params = params, timeout = 5).text
-        list_api_tree = elemtree.fromstring(list_api_res)
-        
-        api_common_err = list_api_tree.find('./cmmMsgHeader/returnAuthMsg')
-        if api_common_err != None:
-            raise GyeonggiApiKeyError(api_common_err.text)
-        
-        api_err = int(list_api_tree.find('./msgHeader/resultCode').text)
-        
-        if api_err != 0 and api_err != 4:
-            raise ValueError(list_api_tree.find('./msgHeader/resultMessage').text)
-        
-        if api_err != 4:
-            list_api_body = list_api_tree.find('./msgBody')
-            xml_bus_list = list_api_body.findall('./busRouteList')
-
-            for i in xml_bus_list:
-                name = i.find('./routeName').text
-                route_id = i.find('./routeId').text
-                region = i.find('./regionName').text
-                route_type = int(i.find('./routeTypeCd').text)
-                
-                bus_info_list.append({'name': name, 'id': route_id, 'desc': region, 'type': route_type})
-    except requests.exceptions.ConnectTimeout:
-        print('Request Timeout')
+    params = {'serviceKey': key, 'keyword': number}
+    
+    list_api_res = fetch('경기', 'http://apis.data.go.kr/6410000/busrouteservice/getBusRouteList', params = params, timeout = 5)
+    list_api_tree = elemtree.fromstring(list_api_res)
+    
+    api_common_err = list_api_tree.find('./cmmMsgHeader/returnAuthMsg')
+    if api_common_err != None:
+        raise GyeonggiApiKeyError(api_common_err.text)
+    
+    api_err = int(list_api_tree.find('./msgHeader/resultCode').text)
+    
+    if api_err != 0 and api_err != 4:
+        raise ValueError(list_api_tree.find('./msgHeader/resultMessage').text)
+    
+    if api_err != 4:
+        list_api_body = list_api_tree.find('./msgBody')
+        xml_bus_list = list_api_body.findall('./busRouteList')
+
+        for i in xml_bus_list:
+            name = i.find('./routeName').text
+            route_id = i.find('./routeId').text
+            region = i.find('./regionName').text
+            route_type = int(i.find('./routeTypeCd').text)
+            
+            bus_info_list.append({'name': name, 'id': route_id, 'desc': region, 'type': route_type})
     
     return bus_info_list
 
+@cached_response('부산', 'search')
 def search_busan_bus_info(key, number):
     bus_info_list = []
     params = {'serviceKey': key, 'lineno': number}
     
-    success = False
+    list_api_res = fetch('부산', 'http://apis.data.go.kr/6260000/BusanBIMS/busInfo', params = params)
+    list_api_tree = elemtree.fromstring(list_api_res)
+    
+    api_common_err = list_api_tree.find('./cmmMsgHeader/returnAuthMsg')
+    if api_common_err != None:
+        raise BusanApiKeyError(api_common_err.text)
+    
+    api_err = int(list_api_tree.find('./header/resultCode').text)
     
-    for i in range(20):
+    if api_err != 0:
+        raise ValueError(list_api_tree.find('./header/resultMsg').text)
+    
+    xml_bus_list = list_api_tree.findall('./body/items/item')
+    
+    for i in xml_bus_list:
+        name = i.find('./buslinenum').text
+        route_id = i.find('./lineid').text
+        start = i.find('./startpoint').text
+        end = i.find('./endpoint').text
+        route_type = convert_busan_bus_type(i.find('./bustype').text)
+        
+        bus_info_list.append({'name': name, 'id': route_id, 'desc': start + '~' + end, 'type': route_type})
+    
+    return bus_info_list
+
+def get_route_catalog():
+    global route_catalog
+    
+    if route_catalog is None:
+        route_catalog = RouteCatalog.load(os.path.join(cache_dir, route_catalog_file))
+    
+    return route_catalog
+
+def sync_route_catalog(key):
+    # 지역별 전체 노선 목록을 받아 노선 목록 캐시를 갱신
+    # 전체 목록 조회 API가 없으므로 숫자 0~9로 각각 검색한 결과를 합침
+    # 실패한 지역이 있으면 기존 목록을 그대로 두고 (기존 목록, 지역별 오류)를 반환
+    global route_catalog
+    
+    search_functions = {'서울': search_seoul_bus_info, '경기': search_gyeonggi_bus_info, '부산': search_busan_bus_info}
+    
+    routes = []
+    errors = {}
+    
+    for region, function in search_functions.items():
+        region_routes = {}
+        
         try:
-            list_api_res = requests.get('http://apis.data.go.kr/6260000/BusanBIMS/busInfo', params = params).text
-            if list_api_res.find('http://apis.data.go.kr/503.html') != -1:
-                raise ServerError('503 Server Unavailable')
-                
-            list_api_tree = elemtree.fromstring(list_api_res)
-            
-            api_common_err = list_api_tree.find('./cmmMsgHeader/returnAuthMsg')
-            if api_common_err != None:
-                raise BusanApiKeyError(api_common_err.text)
-            
-            api_err = int(list_api_tree.find('./header/resultCode').text)
-            
-            if api_err != 0:
-                raise ValueError(list_api_tree.find('./header/resultMsg').text)
-            
-            xml_bus_list = list_api_tree.findall('./body/items/item')
-            
-            for i in xml_bus_list:
-                name = i.find('./buslinenum').text
-                route_id = i.find('./lineid').text
-                start = i.find('./startpoint').text
-                end = i.find('./endpoint').text
-                route_type = convert_busan_bus_type(i.find('./bustype').text)
-                
-                bus_info_list.append({'name': name, 'id': route_id, 'desc': start + '~' + end, 'type': route_type})
+            for digit in '0123456789':
+                for route in function.__wrapped__(key, digit):
+                    region_routes[route['id']] = route
         except Exception as e:
-            error = e
+            errors[region] = e
             continue
-        else:
-            success = True
-            break
+        
+        routes += region_routes.values()
     
-    if not success:
-        raise error
+    if errors:
+        return get_route_catalog(), errors
     
-    return bus_info_list
+    route_catalog = RouteCatalog(routes, time.time(), list(search_functions))
+    route_catalog.save(os.path.join(cache_dir, route_catalog_file))
+    
+    return route_catalog, errors
 
 def search_bus_info(key, number, return_error = False):
     bus_info_list = []
-    exception = None
+    errors = {}
     
-    # 서울 버스 조회
-    try:
-        bus_info_list += search_seoul_bus_info(key, number)
-    except ApiKeyError as api_err:
-        exception = api_err
-    except Exception as e:
-        exception = ValueError('서울 버스 정보를 조회하는 중 오류가 발생했습니다: ' + str(e))
+    search_functions = {'서울': search_seoul_bus_info, '경기': search_gyeonggi_bus_info, '부산': search_busan_bus_info}
     
-    # 경기 버스 조회
-    try:
-        bus_info_list += search_gyeonggi_bus_info(key, number)
-    except ApiKeyError as api_err:
-        exception = api_err
-    except Exception as e:
-        exception = ValueError('경기 버스 정보를 조회하는 중 오류가 발생했습니다: ' + str(e))
+    # 노선 목록 캐시에 포함된 지역은 캐시에서 검색하고, 나머지 지역만 원격 API로 검색
+    # 캐시가 오래되었거나 캐시에서 찾지 못한 경우 모든 지역을 원격 API로 검색
+    catalog = get_route_catalog()
+    
+    if catalog and time.time() - catalog.synced < route_catalog_max_age:
+        bus_info_list = catalog.search(number)
+        
+        if bus_info_list:
+            search_functions = {region: function for region, function in search_functions.items() if region not in catalog.regions}
+    
+    if not search_functions:
+        return (sort_bus_info(bus_info_list, number), None) if return_error else sort_bus_info(bus_info_list, number)
+    
+    # 지역별로 동시에 조회하고, 제한 시간이 지난 지역은 결과 없이 오류로 처리
+    executor = ThreadPoolExecutor(max_workers = len(search_functions))
+    start_time = time.monotonic()
     
-    # 부산 버스 조회
     try:
-        bus_info_list += search_busan_bus_info(key, number)
-    except ApiKeyError as api_err:
-        exception = api_err
-    except Exception as e:
-        exception = ValueError('부산 버스 정보를 조회하는 중 오류가 발생했습니다: ' + str(e))
-        raise
+        futures = {executor.submit(function, key, number): region for region, function in search_functions.items()}
+        pending = set(futures)
         
+        while pending:
+            next_deadline = min(start_time + search_deadline[futures[f]] for f in pending)
+            done, pending = wait(pending, timeout = max(0, next_deadline - time.monotonic()), return_when = FIRST_COMPLETED)
+            
+            for future in done:
+                region = futures[future]
+                
+                try:
+                    bus_info_list += future.result()
+                except ApiKeyError as api_err:
+                    errors[region] = api_err
+                except Exception as e:
+                    errors[region] = ValueError('{} 버스 정보를 조회하는 중 오류가 발생했습니다: '.format(region) + str(e))
+            
+            now = time.monotonic()
+            
+            for future in list(pending):
+                region = futures[future]
+                
+                if now >= start_time + search_deadline[region]:
+                    errors[region] = TimeoutError('{} 버스 정보 조회 시간이 초과되었습니다.'.format(region))
+                    pending.remove(future)
+    finally:
+        executor.shutdown(wait = False, cancel_futures = True)
+    
+    exception = SearchError(errors) if errors else None
+        
+    if return_error:
+        return sort_bus_info(bus_info_list, number), exception
+    else:
+        return sort_bus_info(bus_info_list, number)
+
+def sort_bus_info(bus_info_list, number):
     rx_number = re.compile('[0-9]+')
     is_number = bool(re.match('[0-9]+$', number))
         
@@ -502,12 +714,9 @@ def search_bus_info(key, number, return_error = False):
             else:
                 return x['name']
     
-    if return_error:
-        return sorted(bus_info_list, key=search_score), exception
-    else:
-        return sorted(bus_info_list, key=search_score)
+    return sorted(bus_info_list, key=search_score)
 
-def get_naver_map(mapframe, naver_key_id, naver_key):
+def get_naver_map(mapframe, naver_key_id, naver_key, fp = None):
     route_size = mapframe.size()
     route_size_max = max(route_size)
     pos = mapframe.center()
@@ -532,17 +741,25 @@ def get_naver_map(mapframe, naver_key_id, naver_key):
     
     for p in map_part:
         gps_pos = convert_gps((pos[0] + k * p[0], pos[1] + k * p[1]))
-        map_img.append(requests.get('https://naveropenapi.apigw.ntruss.com/map-static/v2/raster?w=1024&h=1024&center={},{}&level={}&format=png&scale=2'.format(gps_pos[0], gps_pos[1], level), 
+        map_img.append(http_client.get('https://naveropenapi.apigw.ntruss.com/map-static/v2/raster?w=1024&h=1024&center={},{}&level={}&format=png&scale=2'.format(gps_pos[0], gps_pos[1], level), 
             headers={'X-NCP-APIGW-API-KEY-ID': naver_key_id, 'X-NCP-APIGW-API-KEY': naver_key}).content)
     
-    result = ''
+    if fp == None:
+        f = io.StringIO()
+    else:
+        f = fp
     
     for i in range(len(map_part)):
-        result += '<image width="{0}" height="{0}" x="{1}" y="{2}" href="data:image/png;charset=utf-8;base64,{3}" />\n'.format(img_size, pos[0] + k * map_part[i][0] - img_size / 2, pos[1] + k * map_part[i][1] - img_size / 2, base64.b64encode(map_img[i]).decode('utf-8'))
+        f.write('<image width="{0}" height="{0}" x="{1}" y="{2}" href="data:image/png;charset=utf-8;base64,{3}" />\n'.format(img_size, pos[0] + k * map_part[i][0] - img_size / 2, pos[1] + k * map_part[i][1] - img_size / 2, base64.b64encode(map_img[i]).decode('utf-8')))
     
-    return result
+    if fp == None:
+        result = f.getvalue()
+        f.close()
+        return result
 
-def get_mapbox_map(mapframe, mapbox_key, mapbox_style):
+def get_mapbox_map(mapframe, mapbox_key, mapbox_style, fp = None, check_cancelled = None):
+    # fp를 지정하면 타일을 받는 대로 fp에 쓰고, 지정하지 않으면 문자열로 반환
+    # check_cancelled를 지정하면 타일마다 호출하고, 예외가 발생하면 남은 타일은 불러오지 않음
     route_size_max = max(mapframe.size())
     level = 12
     
@@ -557,8 +774,6 @@ def get_mapbox_map(mapframe, mapbox_key, mapbox_style):
     gps_pos = convert_gps((mapframe.right, mapframe.bottom))
     tile_x2, tile_y2 = mapbox.deg2num(gps_pos[1], gps_pos[0], level)
     
-    result = '<g id="background-map">\n'
-    
     tile_pos = mapbox.num2deg(tile_x1, tile_y1, level)
     pos_x1, pos_y1 = convert_pos((tile_pos[1], tile_pos[0]))
     
@@ -566,43 +781,67 @@ def get_mapbox_map(mapframe, mapbox_key, mapbox_style):
     if not os.path.exists(style_cache_dir):
         os.makedirs(style_cache_dir)
     
-    for x in range(tile_x1, tile_x2 + 1):
-        for y in range(tile_y1, tile_y2 + 1):
-            cache_filename = style_cache_dir + '/tile{}-{}-z{}.svg'.format(x, y, level)
-            cache_valid = False
-            tile = None
-            rx_svg = re.compile(r'<svg\s.*?>(.*)</svg>', flags = re.DOTALL)
-            
-            pos_x = pos_x1 + (x - tile_x1) * tile_size
-            pos_y = pos_y1 + (y - tile_y1) * tile_size
-
-            if os.path.exists(cache_filename):
-                with open(cache_filename, mode='r', encoding='utf-8') as f:
-                    text = f.read()
-                    svg_match = rx_svg.search(text)
-                    
-                    if svg_match:
-                        cache_valid = True
-                        tile = svg_match[1]
-            
-            if not cache_valid:
-                try:
-                    cache_io = io.StringIO()
-                    mapbox.load_tile(mapbox_style, mapbox_key, x, y, level, draw_full_svg = True, clip_mask = True, fp = cache_io)
-                    
-                    text = cache_io.getvalue()
-                    tile = rx_svg.search(text)[1]
-
-                    with open(cache_filename, mode='w+', encoding='utf-8') as cache_file:
-                        cache_file.write(text)
-                except:
-                    os.remove(cache_filename)
-                    raise
+    tiles = [(x, y) for x in range(tile_x1, tile_x2 + 1) for y in range(tile_y1, tile_y2 + 1)]
+    
+    if fp == None:
+        f = io.StringIO()
+    else:
+        f = fp
+    
+    f.write('<g id="background-map">\n')
+    
+    # 캐시되지 않은 타일은 병렬로 불러온 뒤 x, y 순서대로 합침
+    with ThreadPoolExecutor(max_workers = tile_workers) as executor:
+        futures = [executor.submit(load_mapbox_tile, style_cache_dir, mapbox_key, mapbox_style, x, y, level) for x, y in tiles]
+        
+        try:
+            for i, (x, y) in enumerate(tiles):
+                if check_cancelled != None:
+                    check_cancelled()
+                
+                tile = futures[i].result()
+                
+                # 이미 쓴 타일은 메모리에서 바로 해제
+                futures[i] = None
+                
+                pos_x = pos_x1 + (x - tile_x1) * tile_size
+                pos_y = pos_y1 + (y - tile_y1) * tile_size
+                
+                f.write('<g id="tile{0}-{1}-z{2}" transform="translate({3}, {4}) scale({5}, {5}) ">\n'.format(x, y, level, pos_x, pos_y, tile_size / 4096))
+                f.write(tile)
+                f.write('</g>\n')
+        except:
+            executor.shutdown(wait = False, cancel_futures = True)
+            raise
             
-            result += '<g id="tile{0}-{1}-z{2}" transform="translate({3}, {4}) scale({5}, {5}) ">\n'.format(x, y, level, pos_x, pos_y, tile_size / 4096)
-            result += tile
-            result += '</g>\n'
+    f.write('</g>\n')
+    
+    if fp == None:
+        result = f.getvalue()
+        f.close()
+        return result
+
+def load_mapbox_tile(style_cache_dir, mapbox_key, mapbox_style, x, y, level):
+    cache_filename = style_cache_dir + '/tile{}-{}-z{}.svg'.format(x, y, level)
+    
+    if os.path.exists(cache_filename):
+        with open(cache_filename, mode='r', encoding='utf-8') as f:
+            svg_match = rx_svg.search(f.read())
             
-    result += '</g>\n'
+            if svg_match:
+                return svg_match[1]
+    
+    cache_io = io.StringIO()
+    mapbox.load_tile(mapbox_style, mapbox_key, x, y, level, draw_full_svg = True, clip_mask = True, fp = cache_io)
+    
+    text = cache_io.getvalue()
+    tile = rx_svg.search(text)[1]
+    
+    # 렌더링이 끝난 타일만 캐시 파일로 저장
+    # 여러 작업 프로세스가 같은 타일을 동시에 만들 수 있으므로 임시 파일은 프로세스와 스레드마다 따로 씀
+    temp_filename = '{}.{}.{}.tmp'.format(cache_filename, os.getpid(), threading.get_ident())
+    with open(temp_filename, mode='w', encoding='utf-8') as cache_file:
+        cache_file.write(text)
+    os.replace(temp_filename, cache_filename)
     
-    return result
\ No newline at end of file
+    return tile
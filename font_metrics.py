@@ -0,0 +1,254 @@
+import os, sys, json, struct, bisect, threading
+
+# 글자 너비를 불러올 글씨체 파일 경로 (파일명에 아래 단어가 포함된 파일만 확인)
+font_dirs = [
+    os.path.join(os.environ.get('WINDIR', 'C:\\Windows'), 'Fonts'),
+    os.path.join(os.environ.get('LOCALAPPDATA', ''), 'Microsoft', 'Windows', 'Fonts'),
+    '/Library/Fonts',
+    os.path.expanduser('~/Library/Fonts'),
+    '/usr/share/fonts',
+    '/usr/local/share/fonts',
+    os.path.expanduser('~/.local/share/fonts'),
+    os.path.expanduser('~/.fonts'),
+]
+font_file_hints = ['kopub', 'nanumsquare', 'din']
+font_extensions = ('.ttf', '.otf', '.ttc')
+
+# 글씨체별 글자 너비 표를 저장하는 캐시 파일
+metrics_cache_file = 'cache/font_metrics.json'
+metrics_cache_version = 1
+
+fonts = None
+fonts_lock = threading.Lock()
+
+class FontMetrics():
+    # 글씨체의 글자별 너비 (em 단위)
+    # ranges: 같은 너비가 이어지는 글자 구간 [시작 코드, 끝 코드, 너비(font unit)] 목록
+    def __init__(self, units_per_em, ranges):
+        self.units_per_em = units_per_em
+        self.ranges = ranges
+        self.range_starts = [r[0] for r in ranges]
+    
+    def get_char_width(self, c):
+        # 글씨체에 없는 글자는 None
+        code = ord(c)
+        i = bisect.bisect_right(self.range_starts, code) - 1
+        
+        if i >= 0 and code <= self.ranges[i][1]:
+            return self.ranges[i][2] / self.units_per_em
+        
+        return None
+
+def normalize_font_name(name):
+    return ''.join(c for c in name.lower() if c not in ' -_')
+
+def read_tables(data, offset):
+    num_tables = struct.unpack_from('>H', data, offset + 4)[0]
+    tables = {}
+    
+    for i in range(num_tables):
+        tag, _, table_offset, length = struct.unpack_from('>4sIII', data, offset + 12 + i * 16)
+        tables[tag.decode('latin-1')] = (table_offset, length)
+    
+    return tables
+
+def parse_names(data, offset):
+    # 글씨체 이름 (전체 이름, 패밀리 이름 + 스타일 이름)
+    _, count, string_offset = struct.unpack_from('>HHH', data, offset)
+    name_ids = {}
+    
+    for i in range(count):
+        platform_id, _, _, name_id, length, name_offset = struct.unpack_from('>6H', data, offset + 6 + i * 12)
+        raw = data[offset + string_offset + name_offset:offset + string_offset + name_offset + length]
+        
+        if platform_id in [0, 3]:
+            text = raw.decode('utf-16-be', errors='ignore')
+        elif platform_id == 1:
+            text = raw.decode('latin-1')
+        else:
+            continue
+        
+        name_ids.setdefault(name_id, set()).add(text)
+    
+    names = set(name_ids.get(4, set()))
+    for family_id, style_id in [(1, 2), (16, 17)]:
+        for family in name_ids.get(family_id, set()):
+            names.add(family)
+            for style in name_ids.get(style_id, set()):
+                names.add(family + ' ' + style)
+    
+    return {normalize_font_name(name) for name in names}
+
+def parse_cmap(data, offset):
+    # 글자 코드 -> 글리프 번호
+    num_subtables = struct.unpack_from('>H', data, offset + 2)[0]
+    subtables = {}
+    
+    for i in range(num_subtables):
+        platform_id, encoding_id, subtable_offset = struct.unpack_from('>HHI', data, offset + 4 + i * 8)
+        subtable_format = struct.unpack_from('>H', data, offset + subtable_offset)[0]
+        subtables[(platform_id, encoding_id, subtable_format)] = offset + subtable_offset
+    
+    cmap = {}
+    
+    for key in [(3, 10, 12), (0, 4, 12), (0, 6, 12)]:
+        if key in subtables:
+            table = subtables[key]
+            num_groups = struct.unpack_from('>I', data, table + 12)[0]
+            
+            for i in range(num_groups):
+                start_code, end_code, start_glyph = struct.unpack_from('>III', data, table + 16 + i * 12)
+                for code in range(start_code, end_code + 1):
+                    cmap[code] = start_glyph + code - start_code
+            
+            return cmap
+    
+    for key in [(3, 1, 4), (0, 3, 4), (0, 1, 4), (0, 0, 4)]:
+        if key in subtables:
+            table = subtables[key]
+            seg_count = struct.unpack_from('>H', data, table + 6)[0] // 2
+            
+            end_codes = struct.unpack_from('>{}H'.format(seg_count), data, table + 14)
+            start_codes = struct.unpack_from('>{}H'.format(seg_count), data, table + 16 + seg_count * 2)
+            id_deltas = struct.unpack_from('>{}h'.format(seg_count), data, table + 16 + seg_count * 4)
+            range_offset_pos = table + 16 + seg_count * 6
+            id_range_offsets = struct.unpack_from('>{}H'.format(seg_count), data, range_offset_pos)
+            
+            for i in range(seg_count):
+                for code in range(start_codes[i], min(end_codes[i], 0xfffe) + 1):
+                    if id_range_offsets[i] == 0:
+                        glyph = (code + id_deltas[i]) & 0xffff
+                    else:
+                        glyph = struct.unpack_from('>H', data, range_offset_pos + i * 2 + id_range_offsets[i] + (code - start_codes[i]) * 2)[0]
+                        if glyph != 0:
+                            glyph = (glyph + id_deltas[i]) & 0xffff
+                    
+                    if glyph != 0:
+                        cmap[code] = glyph
+            
+            return cmap
+    
+    return cmap
+
+def parse_font(data, offset):
+    # 글씨체 하나의 이름 목록과 FontMetrics
+    tables = read_tables(data, offset)
+    
+    for tag in ['head', 'hhea', 'hmtx', 'cmap', 'name']:
+        if tag not in tables:
+            return set(), None
+    
+    units_per_em = struct.unpack_from('>H', data, tables['head'][0] + 18)[0]
+    num_metrics = struct.unpack_from('>H', data, tables['hhea'][0] + 34)[0]
+    advances = struct.unpack_from('>' + 'Hxx' * num_metrics, data, tables['hmtx'][0])
+    
+    cmap = parse_cmap(data, tables['cmap'][0])
+    
+    ranges = []
+    for code in sorted(cmap):
+        width = advances[min(cmap[code], num_metrics - 1)]
+        
+        if ranges and ranges[-1][1] == code - 1 and ranges[-1][2] == width:
+            ranges[-1][1] = code
+        else:
+            ranges.append([code, code, width])
+    
+    return parse_names(data, tables['name'][0]), FontMetrics(units_per_em, ranges)
+
+def read_font_file(path):
+    with open(path, mode='rb') as f:
+        data = f.read()
+    
+    if data[:4] == b'ttcf':
+        num_fonts = struct.unpack_from('>I', data, 8)[0]
+        offsets = struct.unpack_from('>{}I'.format(num_fonts), data, 12)
+    else:
+        offsets = [0]
+    
+    return [parse_font(data, offset) for offset in offsets]
+
+def find_font_files():
+    # 노선도에 쓰는 글씨체 파일 경로와 수정 시각
+    font_files = {}
+    
+    for font_dir in font_dirs:
+        if not font_dir or not os.path.isdir(font_dir):
+            continue
+        
+        for root, _, filenames in os.walk(font_dir):
+            for filename in filenames:
+                lower_name = filename.lower()
+                
+                if lower_name.endswith(font_extensions) and any(hint in lower_name for hint in font_file_hints):
+                    path = os.path.join(root, filename)
+                    stat = os.stat(path)
+                    font_files[path] = [stat.st_mtime, stat.st_size]
+    
+    return font_files
+
+def read_metrics_cache(font_files):
+    try:
+        with open(metrics_cache_file, mode='r', encoding='utf-8') as f:
+            cache_json = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    if cache_json.get('version') != metrics_cache_version or cache_json.get('files') != font_files:
+        return None
+    
+    return [(set(font['names']), FontMetrics(font['units_per_em'], font['ranges'])) for font in cache_json['fonts']]
+
+def write_metrics_cache(font_files, loaded_fonts):
+    folder_path = os.path.dirname(metrics_cache_file)
+    if folder_path and not os.path.exists(folder_path):
+        os.makedirs(folder_path, exist_ok = True)
+    
+    cache_json = {
+        'version': metrics_cache_version,
+        'files': font_files,
+        'fonts': [{'names': sorted(names), 'units_per_em': metrics.units_per_em, 'ranges': metrics.ranges} for names, metrics in loaded_fonts]
+    }
+    
+    # 렌더링 작업 프로세스가 시작할 때 동시에 쓸 수 있으므로 임시 파일은 프로세스마다 따로 씀
+    temp_path = '{}.{}.{}.tmp'.format(metrics_cache_file, os.getpid(), threading.get_ident())
+    with open(temp_path, mode='w', encoding='utf-8') as f:
+        json.dump(cache_json, f, separators = (',', ':'))
+    os.replace(temp_path, metrics_cache_file)
+
+def load_fonts():
+    # 글씨체 이름 -> FontMetrics
+    # 설치된 글씨체 파일이 바뀌지 않았으면 캐시 파일의 너비 표를 사용
+    font_files = find_font_files()
+    
+    loaded_fonts = read_metrics_cache(font_files)
+    
+    if loaded_fonts is None:
+        loaded_fonts = []
+        
+        for path in sorted(font_files):
+            try:
+                loaded_fonts += [(names, metrics) for names, metrics in read_font_file(path) if metrics is not None]
+            except (OSError, struct.error) as e:
+                print('글씨체 파일을 읽을 수 없습니다: {} ({})'.format(path, e), file=sys.stderr)
+        
+        try:
+            write_metrics_cache(font_files, loaded_fonts)
+        except OSError:
+            pass
+    
+    font_dict = {}
+    for names, metrics in loaded_fonts:
+        for name in names:
+            font_dict.setdefault(name, metrics)
+    
+    return font_dict
+
+def get_font(name):
+    # 설치되지 않은 글씨체는 None
+    global fonts
+    
+    with fonts_lock:
+        if fonts is None:
+            fonts = load_fonts()
+    
+    return fonts.get(normalize_font_name(name))
@@ -1,13 +1,16 @@
-import os, sys, json, requests, threading, shutil
+import os, sys, io, json, requests, threading, shutil, multiprocessing, time
 from PySide6.QtWidgets import QApplication, QMainWindow, QLabel, QLineEdit, QHBoxLayout, QVBoxLayout, QWidget, QTableWidget, QTableWidgetItem, QAbstractItemView, QPushButton, QGroupBox, QRadioButton, QSpacerItem, QCheckBox, QProgressBar, QMessageBox, QGridLayout, QSlider, QDialog
 from PySide6.QtSvg import QSvgRenderer
 from PySide6.QtSvgWidgets import QSvgWidget
-from PySide6.QtCore import QByteArray, Qt, QBasicTimer, QObject, QEventLoop, Signal, Slot, QThread
-from PySide6.QtGui import QIcon, QTextDocument, QTextOption, QIntValidator
-import bus_api, routemap, mapbox
+from PySide6.QtCore import QByteArray, Qt, QBasicTimer, QTimer, QObject, QEventLoop, Signal, Slot, QThread, QRectF
+from PySide6.QtGui import QIcon, QTextDocument, QTextOption, QIntValidator, QPainter, QPixmap
+import bus_api, routemap, mapbox, render_worker
 
 version = '1.1'
 
+# 미리보기 설정이 연달아 바뀔 때 마지막 변경 후 렌더링을 시작하기까지 기다리는 시간(ms)
+preview_render_delay = 100
+
 def resource_path(relative_path):
     base_path = getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__)))
     return os.path.join(base_path, relative_path)
@@ -43,18 +46,8 @@ class BusRouteThread(QObject):
         bus_stops = None
         
         try:
-            if route_data['type'] <= 10:
-                route_positions = bus_api.get_seoul_bus_route(self.widget.key, route_data['id'])
-                route_info = bus_api.get_seoul_bus_type(self.widget.key, route_data['id'])
-                bus_stops = bus_api.get_seoul_bus_stops(self.widget.key, route_data['id'])
-            elif route_data['type'] <= 60:
-                route_positions = bus_api.get_gyeonggi_bus_route(self.widget.key, route_data['id'])
-                route_info = bus_api.get_gyeonggi_bus_type(self.widget.key, route_data['id'])
-                bus_stops = bus_api.get_gyeonggi_bus_stops(self.widget.key, route_data['id'])
-            else:
-                route_positions, route_bims_id = bus_api.get_busan_bus_route(route_data['name'])
-                route_info = bus_api.get_busan_bus_type(self.widget.key, route_bims_id)
-                bus_stops = bus_api.get_busan_bus_stops(self.widget.key, route_data['id'], route_bims_id)
+            region = bus_api.convert_type_to_region(route_data['type'])
+            route_positions, route_info, bus_stops = bus_api.load_route(self.widget.key, region, route_data)
         except requests.exceptions.ConnectTimeout:
             error = "[오류] Connection Timeout"
         except Exception as e:
@@ -63,6 +56,26 @@ class BusRouteThread(QObject):
         result_json = json.dumps({'result': {'route_positions': route_positions, 'route_info': route_info, 'bus_stops': bus_stops}, 'error': error})
         self.thread_finished.emit(result_json)
 
+class CatalogSyncThread(QObject):
+    thread_finished = Signal(str)
+    
+    def __init__(self, parent):
+        super(CatalogSyncThread, self).__init__(parent)
+        
+        self.widget = parent
+        
+    def run(self):
+        try:
+            catalog, errors = bus_api.sync_route_catalog(self.widget.key)
+        except Exception as e:
+            self.thread_finished.emit("[오류] " + str(e))
+            return
+        
+        if errors:
+            self.thread_finished.emit("[오류] 노선 목록을 동기화하지 못했습니다: " + str(bus_api.SearchError(errors)))
+        else:
+            self.thread_finished.emit("{}개 노선 목록을 동기화했습니다.".format(len(catalog)))
+
 class OkDialog(QDialog):
     def __init__(self, parent, title, text):
         super().__init__()
@@ -363,7 +376,7 @@ class SizeSlider(QWidget):
         self.slider.setRange(50, 200)
         self.slider.setValue(100)
         self.slider.valueChanged.connect(self.update_label)
-        self.slider.sliderReleased.connect(self.emit_value_changed)
+        self.slider.valueChanged.connect(self.emit_value_changed)
         
         self.label = QLabel(str(self.slider.value()) + '%')
         self.label.setFixedWidth(40)
@@ -384,81 +397,56 @@ class SizeSlider(QWidget):
     def emit_value_changed(self):
         self.valueChanged.emit()
 
-class RenderThread(QThread):
-    render_finished = Signal()
-
-    def __init__(self, parent, draw_background_map = False):
-        super().__init__(parent=parent)
-        self.draw_background_map = draw_background_map
-
-    def run(self):
-        parent = self.parent()
-        theme = 'light' if parent.button_light_theme.isChecked() else 'dark'
-        is_one_way = parent.button_oneway_yes.isChecked()
-    
-        parent.bus_routemap = routemap.RouteMap(parent.route_info, parent.bus_stops, parent.points, is_one_way = is_one_way, theme = theme)
-        
-        route_size = parent.bus_routemap.mapframe.size()
-        
-        if route_size[0] < route_size[1] / 1.5:
-            route_size = (route_size[1] / 1.5, route_size[1])
-        elif route_size[1] < route_size[0] / 1.5:
-            route_size = (route_size[0], route_size[0] / 1.5)
-        
-        size_factor_base = route_size[0] / 640
-        route_size_factor = size_factor_base * (parent.size_slider.value() / 100)
-        info_size_factor = size_factor_base * (parent.info_size_slider.value() / 100) * 0.75
-        circle_size_factor = size_factor_base * (parent.circle_size_slider.value() / 100)
-        text_size_factor = size_factor_base * (parent.text_size_slider.value() / 100)
-        min_interval = 60 * route_size_factor
-        
-        if parent.render_bus_stop_list == None:
-            parent.render_bus_stop_list = parent.bus_routemap.parse_bus_stops(min_interval)
-            parent.trans_id = parent.bus_routemap.trans_id
-        else:
-            parent.bus_routemap.update_trans_id(parent.trans_id)
-        
-        # 노선도 렌더링
-        parent.bus_routemap.render_init()
-        
-        parent.svg_map = parent.bus_routemap.render_path(route_size_factor)
-        for stop in parent.render_bus_stop_list:
-            parent.svg_map += parent.bus_routemap.draw_bus_stop_circle(stop, circle_size_factor)
-            
-            if 'text_dir' in stop:
-                parent.svg_map += parent.bus_routemap.draw_bus_stop_text(stop, text_size_factor, stop['text_dir'])
-            else:
-                parent.svg_map += parent.bus_routemap.draw_bus_stop_text(stop, text_size_factor)
-        parent.svg_map += parent.bus_routemap.draw_bus_info(info_size_factor) + '\n'
-        
-        parent.bus_routemap.mapframe.extend(size_factor_base * 30)
+class PreviewWidget(QWidget):
+    # 래스터화한 배경 위에 노선도 SVG를 그리는 미리보기
+    # 노선도만 바뀐 경우 배경 지도를 다시 해석하거나 래스터화하지 않음
+    def __init__(self, parent):
+        super().__init__(parent)
         
-        if theme == 'light':
-            mapbox_style = 'kiwitree/clinp1vgh002t01q4c2366q3o'
-            page_color = '#ffffff'
-        elif theme == 'dark':
-            mapbox_style = 'kiwitree/clirdaqpr00hu01pu8t7vhmq7'
-            page_color = '#282828'
+        self.background = None
+        self.renderer = QSvgRenderer(self)
+        self.renderer.setAspectRatioMode(Qt.KeepAspectRatio)
+        self.renderer.repaintNeeded.connect(self.update)
+    
+    def set_background(self, pixmap):
+        self.background = pixmap
+        self.update()
+    
+    def load(self, data):
+        self.renderer.load(data)
+        self.update()
+    
+    def paintEvent(self, event):
+        painter = QPainter(self)
         
-        if self.draw_background_map:
-            try:
-                parent.svg_map = bus_api.get_mapbox_map(parent.bus_routemap.mapframe, parent.mapbox_key, mapbox_style) + parent.svg_map
-            except Exception as e:
-                self.render_error.emit(type(e).__name__ + ": " + str(e))
-                raise
-        else:
-            x = parent.bus_routemap.mapframe.left
-            y = parent.bus_routemap.mapframe.top
-            width = parent.bus_routemap.mapframe.width()
-            height = parent.bus_routemap.mapframe.height()
-            
-            parent.svg_map = '<rect x="{}" y="{}" width="{}" height="{}" style="fill:{}" />'.format(x, y, width, height, page_color) + parent.svg_map
+        if self.background != None:
+            painter.drawPixmap(self.rect(), self.background)
+        self.renderer.render(painter, QRectF(self.rect()))
         
-        self.render_finished.emit()
+        painter.end()
 
-class RenderWindow(QWidget):
+class RenderThread(QThread):
+    # 작업 프로세스에 렌더링을 맡기고 결과를 기다림
     render_error = Signal(str)
+
+    def __init__(self, parent, function, request):
+        super().__init__(parent=parent)
+        self.generation = request['generation']
+        self.function = function
+        self.request = request
+        
+        # 렌더링 결과 (취소되거나 실패하면 None)
+        self.result = None
     
+    def run(self):
+        try:
+            self.result = render_worker.submit(self.function, self.request).result()
+        except routemap.RenderCancelled:
+            pass
+        except Exception as e:
+            self.render_error.emit(type(e).__name__ + ": " + str(e))
+
+class RenderWindow(QWidget):
     def __init__(self, parent, route_info, bus_stops, points):
         super().__init__()
         
@@ -471,8 +459,31 @@ class RenderWindow(QWidget):
         self.mapbox_key = parent.mapbox_key
         self.key = parent.key
         
+        self.background_key = None
+        self.mapframe = None
+        self.svg_background = None
         self.svg_map = None
+        self.background_pixmap = None
+        self.background_pixmap_key = None
+        
+        # 미리보기 렌더링 예약
+        # 설정이 바뀔 때마다 render_generation을 올리고, 마지막으로 요청한 렌더링의 결과만 반영
+        # 노선도와 배경은 창마다 따로 받은 칸에서 취소
+        self.render_id = render_worker.new_render_id()
+        self.render_slot = render_worker.acquire_slot()
+        self.background_slot = render_worker.acquire_slot()
+        self.render_generation = 0
+        self.render_pending = False
+        
+        # 마지막 렌더링에 필요한 배경과 작업 프로세스에서 만들고 있는 배경
+        self.render_background_key = None
+        self.building_background_key = None
+        self.render_timer = QTimer(self)
+        self.render_timer.setSingleShot(True)
+        self.render_timer.setInterval(preview_render_delay)
+        self.render_timer.timeout.connect(self.start_render)
         self.render_bus_stop_list = None
+        self.trans_id = None
         
         self.setWindowTitle("{}".format(route_info['name']))
         
@@ -545,8 +556,11 @@ class RenderWindow(QWidget):
         else:
             self.checkbox_background_map.setChecked(True)
         
+        self.checkbox_optimize_text = QCheckBox("정류장명 위치 자동 최적화", group_etc)
+        
         group_etc_layout = QVBoxLayout(group_etc)
         group_etc_layout.addWidget(self.checkbox_background_map)
+        group_etc_layout.addWidget(self.checkbox_optimize_text)
         
         self.execute_button = QPushButton("저장")
         
@@ -571,8 +585,7 @@ class RenderWindow(QWidget):
         
         self.svg_container = QWidget()
         
-        self.svg_widget = QSvgWidget(self.svg_container)
-        self.svg_widget.renderer().setAspectRatioMode(Qt.KeepAspectRatio)
+        self.svg_widget = PreviewWidget(self.svg_container)
         
         preview_layout = QVBoxLayout()
         preview_layout.addWidget(preview_label)
@@ -597,10 +610,25 @@ class RenderWindow(QWidget):
         self.button_oneway_no.clicked.connect(self.refresh_preview)
         
         self.checkbox_background_map.clicked.connect(self.refresh_preview)
+        self.checkbox_optimize_text.clicked.connect(self.refresh_preview)
     
     def showEvent(self, event):
         self.refresh_preview()
     
+    def closeEvent(self, event):
+        # 진행 중인 렌더링은 결과를 버리고 취소용 칸을 돌려줌
+        self.render_timer.stop()
+        self.render_generation = render_worker.new_generation()
+        self.building_background_key = None
+        
+        render_worker.release_slot(self.render_slot)
+        render_worker.release_slot(self.background_slot)
+        self.render_slot = None
+        self.background_slot = None
+        
+        self.finish_render()
+        super().closeEvent(event)
+    
     def bus_stop_edit_window(self):
         self.stop_edit_window = BusStopEditWindow(self)
         self.stop_edit_window.show()
@@ -610,20 +638,138 @@ class RenderWindow(QWidget):
         self.info_edit_window.show()
     
     def refresh_preview(self):
-        self.render_thread = RenderThread(self, self.checkbox_background_map.isChecked())
-        self.render_thread.start()
-        self.render_thread.render_finished.connect(self.refresh_preview_after)
-        QApplication.setOverrideCursor(Qt.WaitCursor)
+        # 진행 중인 렌더링은 취소하고, 설정 변경이 멈추면 새로 렌더링
+        self.render_generation = render_worker.new_generation()
+        self.render_background_key = None
+        render_worker.cancel(self.render_slot, self.render_generation)
+        
+        if not self.render_pending:
+            self.render_pending = True
+            self.execute_button.setEnabled(False)
+            QApplication.setOverrideCursor(Qt.WaitCursor)
+        
+        self.render_timer.start()
+    
+    def finish_render(self):
+        # 노선도와 필요한 배경을 모두 반영했거나 렌더링이 취소, 실패한 경우
+        if not self.render_pending:
+            return
+        
+        self.render_pending = False
+        self.execute_button.setEnabled(True)
+        QApplication.restoreOverrideCursor()
+    
+    def get_render_request(self):
+        # 작업 프로세스에 보내는 노선 정보와 렌더링 설정
+        return {
+            'render_id': self.render_id,
+            'slot': self.render_slot,
+            'generation': self.render_generation,
+            'route_info': self.route_info,
+            'bus_stops': self.bus_stops,
+            'points': self.points,
+            'theme': 'light' if self.button_light_theme.isChecked() else 'dark',
+            'is_one_way': self.button_oneway_yes.isChecked(),
+            'size': self.size_slider.value(),
+            'info_size': self.info_size_slider.value(),
+            'circle_size': self.circle_size_slider.value(),
+            'text_size': self.text_size_slider.value(),
+            'optimize_text': self.checkbox_optimize_text.isChecked(),
+            'draw_background_map': self.checkbox_background_map.isChecked(),
+            'mapbox_key': self.mapbox_key,
+            'bus_stop_list': self.render_bus_stop_list,
+            'trans_id': self.trans_id
+        }
+    
+    def start_render(self):
+        # 이전 렌더링은 작업 프로세스에서 취소되므로 끝나기를 기다리지 않음
+        render_thread = RenderThread(self, render_worker.render, self.get_render_request())
+        render_thread.render_error.connect(self.render_error)
+        render_thread.finished.connect(lambda: self.render_thread_finished(render_thread))
+        render_thread.finished.connect(render_thread.deleteLater)
+        render_thread.start()
+    
+    def start_background(self, background_key):
+        # 다른 배경을 만들고 있었으면 취소 (배경 지도 타일 사이에서 중단)
+        self.building_background_key = background_key
+        generation = render_worker.new_generation()
+        render_worker.cancel(self.background_slot, generation)
+        
+        request = {
+            'slot': self.background_slot,
+            'generation': generation,
+            'background_key': background_key,
+            'mapframe': self.mapframe,
+            'mapbox_key': self.mapbox_key
+        }
+        
+        background_thread = RenderThread(self, render_worker.render_background, request)
+        background_thread.render_error.connect(self.render_error)
+        background_thread.finished.connect(lambda: self.background_thread_finished(background_thread))
+        background_thread.finished.connect(background_thread.deleteLater)
+        background_thread.start()
+    
+    def render_error(self, msg):
+        # 렌더링에 실패해도 창은 그대로 두고 오류만 표시
+        self.parent_widget.status_label.setText("[오류] " + msg)
+        self.finish_render()
+    
+    def cancel_background(self):
+        if self.building_background_key != None:
+            self.building_background_key = None
+            render_worker.cancel(self.background_slot, render_worker.new_generation())
+    
+    def render_thread_finished(self, render_thread):
+        # 렌더링 도중 설정이 바뀌었으면 결과를 버림
+        if render_thread.generation != self.render_generation:
+            return
+        
+        result = render_thread.result
+        
+        if result == None:
+            self.finish_render()
+            return
+        
+        if self.render_bus_stop_list == None:
+            self.render_bus_stop_list = result['bus_stop_list']
+            self.trans_id = result['trans_id']
+        
+        self.mapframe = result['mapframe']
+        self.svg_map = result['svg_map']
+        self.render_background_key = result['background_key']
+        
+        # 배경이 바뀌었을 때만 따로 만들고, 같은 배경을 이미 만들고 있으면 다시 요청하지 않음
+        # 배경이 준비될 때까지는 이전 배경 위에 노선도를 그림
+        if self.render_background_key == self.background_key:
+            self.cancel_background()
+        elif self.render_background_key != self.building_background_key:
+            self.start_background(self.render_background_key)
+        
+        self.refresh_preview_after()
+        
+        if self.render_background_key == self.background_key:
+            self.finish_render()
+    
+    def background_thread_finished(self, background_thread):
+        # 만드는 도중 다른 배경이 필요해졌으면 결과를 버림
+        background_key = background_thread.request['background_key']
+        
+        if background_key != self.building_background_key:
+            return
+        
+        self.building_background_key = None
+        
+        if background_thread.result != None:
+            self.svg_background = background_thread.result
+            self.background_key = background_key
+            self.refresh_preview_after()
+        
+        if background_key == self.render_background_key:
+            self.finish_render()
 
     def refresh_preview_after(self):
-        width = self.bus_routemap.mapframe.width()
-        height = self.bus_routemap.mapframe.height()
-        
-        svg = '<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n'
-        svg += '<svg width="{0}" height="{1}" viewBox="0 0 {0} {1}" xmlns="http://www.w3.org/2000/svg"><style></style>\n'.format(width, height)
-        svg += '<g transform="translate({}, {})">\n'.format(-self.bus_routemap.mapframe.left, -self.bus_routemap.mapframe.top)
-        svg += self.svg_map
-        svg += '</g></svg>'
+        width = self.mapframe.width()
+        height = self.mapframe.height()
         
         if height > width:
             widget_width = self.svg_container.width()
@@ -632,9 +778,16 @@ class RenderWindow(QWidget):
             widget_width = self.svg_container.height() * width / height
             widget_height = self.svg_container.height()
         
-        self.svg_widget.load(QByteArray(svg.encode()))
         self.svg_widget.resize(widget_width, widget_height)
         
+        # 배경은 래스터화한 이미지를 다시 사용하고, 노선도만 SVG로 불러옴
+        # 전체 SVG는 내보낼 때만 만듦
+        self.svg_widget.set_background(self.get_background_pixmap(width, height))
+        
+        svg = io.StringIO()
+        self.write_svg(svg, width, height, draw_background = False)
+        self.svg_widget.load(QByteArray(svg.getvalue().encode()))
+        
         window_width = self.width()
         window_height = self.height()
         
@@ -643,9 +796,56 @@ class RenderWindow(QWidget):
         else:
             self.setFixedSize(window_width, max(self.minimum_height, window_height + (widget_height - self.svg_container.height())))
             
-        QApplication.restoreOverrideCursor()
         QApplication.processEvents()
     
+    def get_background_pixmap(self, width, height):
+        # 배경 지도 범위, 확대 수준(지도 범위에서 결정), 스타일과 미리보기 크기가 바뀌었을 때만 다시 래스터화
+        # 배경을 만드는 동안에는 이전 배경을 현재 노선도 범위에 맞춰 그림
+        if self.svg_background == None:
+            return None
+        
+        pixel_ratio = self.svg_widget.devicePixelRatioF()
+        pixmap_width = self.svg_widget.width()
+        pixmap_height = self.svg_widget.height()
+        background_pixmap_key = (self.background_key, self.mapframe.left, self.mapframe.top, self.mapframe.right, self.mapframe.bottom, pixmap_width, pixmap_height, pixel_ratio)
+        
+        if background_pixmap_key != self.background_pixmap_key:
+            svg = io.StringIO()
+            self.write_svg(svg, width, height, draw_map = False)
+            renderer = QSvgRenderer(QByteArray(svg.getvalue().encode()))
+            renderer.setAspectRatioMode(Qt.KeepAspectRatio)
+            
+            pixmap = QPixmap(round(pixmap_width * pixel_ratio), round(pixmap_height * pixel_ratio))
+            pixmap.setDevicePixelRatio(pixel_ratio)
+            pixmap.fill(Qt.transparent)
+            
+            painter = QPainter(pixmap)
+            renderer.render(painter, QRectF(0, 0, pixmap_width, pixmap_height))
+            painter.end()
+            
+            self.background_pixmap = pixmap
+            self.background_pixmap_key = background_pixmap_key
+        
+        return self.background_pixmap
+    
+    def write_svg(self, f, width, height, page_color = None, draw_background = True, draw_map = True):
+        # page_color를 지정하면 Inkscape 페이지 설정까지 포함
+        # draw_background, draw_map: 미리보기에서 배경과 노선도를 따로 그릴 때 사용
+        f.write('<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n')
+        
+        if page_color:
+            f.write('<svg width="{0}" height="{1}" viewBox="0 0 {0} {1}" xmlns="http://www.w3.org/2000/svg" xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape" xmlns:sodipodi="http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd"><style></style>\n'.format(width, height))
+            f.write('<sodipodi:namedview id="namedview1" pagecolor="{}" bordercolor="#cccccc" borderopacity="1" inkscape:deskcolor="#e5e5e5"/>'.format(page_color))
+        else:
+            f.write('<svg width="{0}" height="{1}" viewBox="0 0 {0} {1}" xmlns="http://www.w3.org/2000/svg"><style></style>\n'.format(width, height))
+        
+        f.write('<g transform="translate({}, {})">\n'.format(-self.mapframe.left, -self.mapframe.top))
+        if draw_background and self.svg_background != None:
+            f.write(self.svg_background)
+        if draw_map:
+            f.write(self.svg_map)
+        f.write('</g></svg>')
+    
     def export(self):
         filename = self.filename_input.text()
         folder_path = os.path.dirname(filename)
@@ -662,8 +862,8 @@ class RenderWindow(QWidget):
             if not result:
                 return
         
-        width = self.bus_routemap.mapframe.width()
-        height = self.bus_routemap.mapframe.height()
+        width = self.mapframe.width()
+        height = self.mapframe.height()
         
         if self.button_light_theme.isChecked():
             page_color = '#ffffff'
@@ -671,12 +871,7 @@ class RenderWindow(QWidget):
             page_color = '#282828'
         
         with open(filename, mode='w+', encoding='utf-8') as f:
-            f.write('<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n')
-            f.write('<svg width="{0}" height="{1}" viewBox="0 0 {0} {1}" xmlns="http://www.w3.org/2000/svg" xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape" xmlns:sodipodi="http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd"><style></style>\n'.format(width, height))
-            f.write('<sodipodi:namedview id="namedview1" pagecolor="{}" bordercolor="#cccccc" borderopacity="1" inkscape:deskcolor="#e5e5e5"/>'.format(page_color))
-            f.write('<g transform="translate({}, {})">\n'.format(-self.bus_routemap.mapframe.left, -self.bus_routemap.mapframe.top))
-            f.write(self.svg_map)
-            f.write('</g></svg>')
+            self.write_svg(f, width, height, page_color)
         
         self.parent_widget.status_label.setText('"{}"로 내보냈습니다.'.format(filename))
         self.close()
@@ -710,6 +905,21 @@ class OptionsWindow(QWidget):
         api_key_grid_layout.addWidget(QLabel("Mapbox 키: "), 1, 0)
         api_key_grid_layout.addWidget(self.mapbox_key_input, 1, 1)
         
+        group_catalog = QGroupBox("노선 목록")
+        
+        catalog = bus_api.get_route_catalog()
+        if catalog:
+            catalog_text = "{}개 노선 ({} 동기화)".format(len(catalog), time.strftime('%Y-%m-%d', time.localtime(catalog.synced)))
+        else:
+            catalog_text = "동기화한 노선 목록 없음"
+        
+        self.catalog_sync_button = QPushButton("동기화")
+        self.catalog_sync_button.clicked.connect(self.sync_route_catalog)
+        
+        catalog_layout = QHBoxLayout(group_catalog)
+        catalog_layout.addWidget(QLabel(catalog_text), stretch = 1)
+        catalog_layout.addWidget(self.catalog_sync_button)
+        
         self.cancel_button = QPushButton("취소")
         self.execute_button = QPushButton("저장")
         
@@ -723,11 +933,12 @@ class OptionsWindow(QWidget):
 
         layout = QVBoxLayout()
         layout.addWidget(group_api_key)
+        layout.addWidget(group_catalog)
         layout.addStretch(1)
         layout.addLayout(execute_layout)
 
         self.setLayout(layout)
-        self.setFixedSize(360, 140)
+        self.setFixedSize(360, 200)
     
     def cancel(self):
         self.close()
@@ -736,6 +947,10 @@ class OptionsWindow(QWidget):
         self.parent_widget.update_key(self.openapi_key_input.text(), self.mapbox_key_input.text())
         self.parent_widget.save_key()
         self.close()
+    
+    def sync_route_catalog(self):
+        self.parent_widget.sync_route_catalog()
+        self.close()
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -747,9 +962,12 @@ class MainWindow(QMainWindow):
             
         self.bus_info_thread = BusInfoThread(self)
         self.bus_route_thread = BusRouteThread(self)
+        self.catalog_sync_thread = CatalogSyncThread(self)
+        self.catalog_syncing = False
         
         self.bus_info_thread.thread_finished.connect(self.bus_info_finished)
         self.bus_route_thread.thread_finished.connect(self.bus_route_finished)
+        self.catalog_sync_thread.thread_finished.connect(self.catalog_sync_finished)
         
         self.setWindowTitle("버스 노선도 생성기 GUI")
         
@@ -927,21 +1145,29 @@ class MainWindow(QMainWindow):
         self.bus_stops = result['result']['bus_stops']
         route_positions = result['result']['route_positions']
         
-        self.preview_points = []
-
-        for pos in route_positions:
-            self.preview_points.append(routemap.convert_pos(pos))
+        self.preview_points = routemap.convert_pos_list(route_positions)
         
         self.render_preview_routemap()
     
     def open_render_window(self):
         self.render_window = RenderWindow(self, self.route_info, self.bus_stops, self.preview_points)
-        self.render_window.render_error.connect(self.render_error)
         self.render_window.show()
     
-    def render_error(self, msg):
-        self.status_label.setText("[오류] " + msg)
-        del self.render_window
+    def sync_route_catalog(self):
+        if self.catalog_syncing:
+            return
+        
+        self.catalog_syncing = True
+        self.status_label.setText("노선 목록 동기화 중...")
+        
+        t = threading.Thread(target=self.catalog_sync_thread.run)
+        t.daemon = True
+        t.start()
+    
+    @Slot(str)
+    def catalog_sync_finished(self, message):
+        self.catalog_syncing = False
+        self.status_label.setText(message)
     
     def open_option_window(self):
         self.option_window = OptionsWindow(self)
@@ -1013,9 +1239,13 @@ class MainWindow(QMainWindow):
         self.render_preview_routemap()
     
 if __name__ == '__main__':
+    # 실행 파일에서 렌더링 작업 프로세스를 시작할 수 있도록 함
+    multiprocessing.freeze_support()
+
     app = QApplication(sys.argv)
 
     window = MainWindow()
     window.show()
 
-    app.exec()
\ No newline at end of file
+    app.exec()
+    render_worker.shutdown()
\ No newline at end of file
@@ -0,0 +1,125 @@
+import requests, threading, time, random
+from requests.adapters import HTTPAdapter
+
+# 호스트별로 유지하는 연결 풀의 수와 풀당 최대 연결 수
+pool_connections = 10
+pool_maxsize = 10
+
+# 요청 시간 제한(초)
+default_timeout = 20
+
+# 재시도 횟수와 지수 백오프 대기 시간(초)
+retry_count = 3
+retry_backoff = 0.5
+retry_backoff_max = 4
+
+session = None
+session_lock = threading.Lock()
+
+class CircuitOpenError(Exception):
+    def __init__(self, name, remaining):
+        self.name = name
+        self.remaining = remaining
+        super().__init__('{} 서버 응답이 없어 요청을 일시 중단했습니다. ({:.0f}초 후 재시도)'.format(name, remaining))
+
+class CircuitBreaker():
+    # 연속으로 실패한 서버는 일정 시간 동안 요청하지 않고 바로 실패 처리
+    def __init__(self, name, failure_threshold = 5, cooldown = 60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        
+        self.failures = 0
+        self.open_until = 0
+        self.lock = threading.Lock()
+    
+    def check(self):
+        with self.lock:
+            remaining = self.open_until - time.monotonic()
+            if remaining > 0:
+                raise CircuitOpenError(self.name, remaining)
+    
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.open_until = 0
+    
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            
+            # 대기 시간이 지난 뒤 첫 요청이 실패하면 바로 다시 차단
+            if self.failures >= self.failure_threshold:
+                self.open_until = time.monotonic() + self.cooldown
+
+def create_session():
+    new_session = requests.Session()
+    
+    adapter = HTTPAdapter(pool_connections = pool_connections, pool_maxsize = pool_maxsize)
+    new_session.mount('http://', adapter)
+    new_session.mount('https://', adapter)
+    
+    new_session.headers['Accept-Encoding'] = 'gzip, deflate'
+    
+    return new_session
+
+def get_session():
+    global session
+    
+    with session_lock:
+        if session is None:
+            session = create_session()
+        
+        return session
+
+def configure(pool_size = None, timeout = None):
+    global session, pool_maxsize, default_timeout
+    
+    with session_lock:
+        if pool_size is not None:
+            pool_maxsize = pool_size
+        
+        if timeout is not None:
+            default_timeout = timeout
+        
+        # 다음 요청부터 새 설정으로 연결 풀을 다시 만듦
+        if session is not None:
+            session.close()
+            session = None
+
+def get(url, params = None, timeout = None, **kwargs):
+    if timeout is None:
+        timeout = default_timeout
+    
+    return get_session().get(url, params = params, timeout = timeout, **kwargs)
+
+def get_backoff(attempt):
+    # full jitter 방식의 지수 백오프
+    return random.uniform(0, min(retry_backoff_max, retry_backoff * 2 ** attempt))
+
+def get_with_retry(url, params = None, timeout = None, breaker = None, is_retryable = None, **kwargs):
+    # 연결 오류, 시간 초과, is_retryable이 참인 응답은 재시도
+    # 재시도 후에도 is_retryable이 참이면 마지막 응답을 그대로 반환
+    for attempt in range(retry_count + 1):
+        if breaker:
+            breaker.check()
+        
+        try:
+            response = get(url, params = params, timeout = timeout, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if breaker:
+                breaker.record_failure()
+            if attempt == retry_count:
+                raise
+        else:
+            if not (is_retryable and is_retryable(response)):
+                if breaker:
+                    breaker.record_success()
+                return response
+            
+            if breaker:
+                breaker.record_failure()
+            if attempt == retry_count:
+                return response
+        
+        time.sleep(get_backoff(attempt))
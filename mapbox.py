@@ -1,17 +1,33 @@
-import math, requests, json, re, io, colorsys, sys, os
+import math, requests, json, re, io, colorsys, sys, os, time, threading, functools, operator
 import mapbox_vector_tile
+import http_client
 
 tile_url = 'https://api.mapbox.com/v4/{}/{}/{}/{}.mvt'
 style_url = 'https://api.mapbox.com/styles/v1/{}'
-properties = {}
 
 sprite_cache = {}
+style_cache = {}
+style_lock = threading.Lock()
+
+# 식으로 평가하지 않고 그대로 사용하는 속성
+raw_properties = {'line-dasharray', 'text-font'}
+
+rx_hsl = re.compile(r'hsl\(\s*(\d+),\s*(\d+)%,\s*(\d+)%\s*\)')
+rx_hsla = re.compile(r'hsla\(\s*(\d+),\s*(\d+)%,\s*(\d+)%\s*,\s*[0-9.]+\)')
+rx_rgb = re.compile(r'rgb\(\s*(\d+),\s*(\d+),\s*(\d+)\s*\)')
+rx_hex = re.compile(r'#([0-9a-fA-F]{3}|[0-9a-fA-F]{6})$')
+
+style_cache_dir = 'cache/styles'
+tile_cache_dir = 'cache/tiles'
+style_cache_version = 1
+# 디스크에 저장된 스타일을 재검증 없이 사용하는 기간(초)
+style_max_age = 24 * 60 * 60
 
 class MapBoxError(Exception):
     pass
 
 def check_token_valid(token):
-    response = requests.get(style_url.format(''), params = {'access_token': token})
+    response = http_client.get(style_url.format(''), params = {'access_token': token})
     if response.status_code == 401:
         return False
     else:
@@ -48,12 +64,8 @@ def css_style(style):
 def rgb_to_hex(rgb):
     return '#{:02x}{:02x}{:02x}'.format(int(rgb[0] * 255), int(rgb[1] * 255), int(rgb[2] * 255))
 
+@functools.lru_cache(maxsize = 4096)
 def color_to_rgb(color):
-    rx_hsl = re.compile(r'hsl\(\s*(\d+),\s*(\d+)%,\s*(\d+)%\s*\)')
-    rx_hsla = re.compile(r'hsla\(\s*(\d+),\s*(\d+)%,\s*(\d+)%\s*,\s*[0-9.]+\)')
-    rx_rgb = re.compile(r'rgb\(\s*(\d+),\s*(\d+),\s*(\d+)\s*\)')
-    rx_hex = re.compile(r'#([0-9a-fA-F]{3}|[0-9a-fA-F]{6})$')
-    
     hsl_match = rx_hsl.match(color)
     if hsl_match:
         return colorsys.hls_to_rgb(int(hsl_match[1])/360, int(hsl_match[3])/100, int(hsl_match[2])/100)
@@ -75,171 +87,290 @@ def color_to_rgb(color):
     
     raise ValueError('Unknown Color: "{}"'.format(color))
 
+@functools.lru_cache(maxsize = 4096)
 def color_to_hex(color):
     return rgb_to_hex(color_to_rgb(color))
 
-def interpolate_color(expression, method, input_value, feature):
-    if len(expression) % 2 != 0:
+def interpolate_color(stops, input_value):
+    for i in range(0, len(stops), 2):
+        if input_value < stops[i]:
+            return color_to_hex(stops[i+1])
+    
+    return color_to_hex(stops[-1])
+    
+    # todo: implement color interpolation
+
+class Constant():
+    # 지물(feature)과 무관하게 값이 정해지는 식
+    def __init__(self, value):
+        self.value = value
+    
+    def __call__(self, feature):
+        return self.value
+
+def is_constant(*functions):
+    return all(isinstance(f, Constant) for f in functions)
+
+def fold_constant(function, *args):
+    # 인자가 모두 상수이면 컴파일 시점에 미리 계산
+    if not is_constant(*args):
+        return function
+    
+    try:
+        return Constant(function(None))
+    except Exception:
+        return function
+
+def get_geometry_type(feature):
+    geometry_type = feature['geometry']['type']
+    if geometry_type == 'MultiPolygon':
+        return 'Polygon'
+    elif geometry_type == 'MultiLineString':
+        return 'LineString'
+    else:
+        return geometry_type
+
+def compile_interpolate(method, input_fn, stops, zoom):
+    if len(stops) % 2 != 0:
         raise ValueError()
     
-    color_list = []
-    value_list = []
+    inputs = stops[0::2]
+    outputs = [compile_expression(x, zoom) for x in stops[1::2]]
     
-    for i in range(0, len(expression), 2):
-        color_list.append(expression[i+1])
-        value_list.append(expression[i])
+    def interpolate_value(value, feature):
+        if value < inputs[0]:
+            return outputs[0](feature)
+        
+        if value >= inputs[-1]:
+            return outputs[-1](feature)
+        
+        result_type = outputs[-1](feature)
+        if isinstance(result_type, int) or isinstance(result_type, float):
+            for i in range(1, len(inputs)):
+                if value < inputs[i]:
+                    right_value = outputs[i](feature)
+                    left_value = outputs[i-1](feature)
+                    return ((value - inputs[i-1]) / (inputs[i] - inputs[i-1])) * (right_value - left_value) + left_value
+        else:
+            return interpolate_color(stops, value)
     
-    rgbs = []
-    result = None
+    # todo: implement exponentional interpolation
     
-    for color in color_list:
-        rgbs.append(color_to_rgb(color))
+    if not is_constant(input_fn):
+        return lambda feature: interpolate_value(input_fn(feature), feature)
     
-    for i in range(len(value_list)):
-        if input_value < value_list[i]:
-            return rgb_to_hex(rgbs[i])
+    # 줌 레벨 등 입력값이 상수이면 해당 구간의 출력식만 남김
+    value = input_fn.value
     
-    return rgb_to_hex(rgbs[-1])
+    if value < inputs[0]:
+        return outputs[0]
     
-    # todo: implement color interpolation
+    if value >= inputs[-1]:
+        return outputs[-1]
+    
+    return fold_constant(lambda feature: interpolate_value(value, feature), *outputs)
 
-def interpolate(expression, method, input_value, feature):
-    if len(expression) % 2 != 0:
-        raise ValueError()
+def compile_match(input_fn, values, zoom):
+    labels = {}
     
-    value = get_value(input_value, feature)
+    for i in range(1, len(values) - 1, 2):
+        output_fn = compile_expression(values[i+1], zoom)
+        
+        for label in (values[i] if isinstance(values[i], list) else [values[i]]):
+            labels.setdefault(label, output_fn)
     
-    if value < expression[0]:
-        return get_value(expression[1], feature)
+    default_fn = compile_expression(values[-1], zoom)
     
-    if value >= expression[-2]:
-        return get_value(expression[-1], feature)
+    def match(feature):
+        try:
+            return labels.get(input_fn(feature), default_fn)(feature)
+        except TypeError:
+            return default_fn(feature)
     
-    result_type = get_value(expression[-1], feature)
-    if isinstance(result_type, int) or isinstance(result_type, float):
-        for i in range(2, len(expression), 2):
-            if value < expression[i]:
-                right_value = get_value(expression[i+1], feature)
-                left_value = get_value(expression[i-1], feature)
-                return ((value - expression[i-2]) / (expression[i] - expression[i-2])) * (right_value - left_value) + left_value
-    else:
-        return interpolate_color(expression, method, value, feature)
+    if is_constant(input_fn):
+        try:
+            return labels.get(input_fn.value, default_fn)
+        except TypeError:
+            return default_fn
     
-    # todo: implement exponentional interpolation
+    return match
 
-def get_value(expression, feature):
-    if isinstance(expression, list):
-        op = expression[0]
-        values = expression[1:]
+def compile_case(values, zoom):
+    branches = []
+    
+    for i in range(0, len(values) - 1, 2):
+        condition_fn = compile_expression(values[i], zoom)
+        output_fn = compile_expression(values[i+1], zoom)
         
-        if not isinstance(op, str):
-            return expression
+        if is_constant(condition_fn):
+            if condition_fn.value:
+                # 항상 참인 조건 이후의 분기는 평가되지 않음
+                if not branches:
+                    return output_fn
+                default_fn = output_fn
+                break
+            continue
         
-        if op == '!':
-            return not get_value(values[0], feature)
-        elif op == '==':
-            return get_value(values[0], feature) == get_value(values[1], feature)
-        elif op == '!=':
-            return get_value(values[0], feature) != get_value(values[1], feature)
-        elif op == '>':
-            return get_value(values[0], feature) > get_value(values[1], feature)
-        elif op == '<':
-            return get_value(values[0], feature) < get_value(values[1], feature)
-        elif op == '>=':
-            return get_value(values[0], feature) >= get_value(values[1], feature)
-        elif op == '<=':
-            return get_value(values[0], feature) <= get_value(values[1], feature)
-        elif op == '+':
-            return get_value(values[0], feature) + get_value(values[1], feature)
-        elif op == '-':
-            return get_value(values[0], feature) - get_value(values[1], feature)
-        elif op == '*':
-            return get_value(values[0], feature) * get_value(values[1], feature)
-        elif op == '/':
-            return get_value(values[0], feature) / get_value(values[1], feature)
-        elif op == 'sqrt':
-            return math.sqrt(get_value(values[0], feature))
-        elif op == 'zoom':
-            return properties['zoom']
-        elif op == 'all':
-            for value in values:
-                if not get_value(value, feature):
+        branches.append((condition_fn, output_fn))
+    else:
+        default_fn = compile_expression(values[-1], zoom)
+        
+        if not branches:
+            return default_fn
+    
+    def case(feature):
+        for condition_fn, output_fn in branches:
+            if condition_fn(feature):
+                return output_fn(feature)
+        return default_fn(feature)
+    
+    return case
+
+def compile_step(input_fn, values, zoom):
+    stops = values[2:-1:2]
+    outputs = [compile_expression(x, zoom) for x in values[1::2]]
+    
+    def step_index(label):
+        for i, stop in enumerate(stops):
+            if stop > label:
+                return i
+        return len(outputs) - 1
+    
+    if is_constant(input_fn):
+        return outputs[step_index(input_fn.value)]
+    
+    return lambda feature: outputs[step_index(input_fn(feature))](feature)
+
+unary_operators = {
+    '!': operator.not_,
+    'sqrt': math.sqrt,
+    'to-number': int,
+    'to-string': str
+}
+
+binary_operators = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '<': operator.lt,
+    '>=': operator.ge,
+    '<=': operator.le,
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv
+}
+
+def compile_operator(op, values, zoom):
+    if op == 'literal':
+        return Constant(values[0])
+    elif op == 'zoom':
+        return Constant(zoom)
+    elif op == 'get':
+        name = values[0]
+        return lambda feature: feature['properties'].get(name, 0)
+    elif op == 'has':
+        if len(values) != 1:
+            raise ValueError()
+        name = values[0]
+        return lambda feature: name in feature['properties']
+    elif op == 'geometry-type':
+        return get_geometry_type
+    elif op == 'match':
+        return compile_match(compile_expression(values[0], zoom), values, zoom)
+    elif op == 'case':
+        return compile_case(values, zoom)
+    elif op == 'step':
+        return compile_step(compile_expression(values[0], zoom), values, zoom)
+    elif op == 'interpolate':
+        return compile_interpolate(values[0], compile_expression(values[1], zoom), values[2:], zoom)
+    
+    args = [compile_expression(x, zoom) for x in values]
+    
+    if op in unary_operators:
+        function = unary_operators[op]
+        a = args[0]
+        return fold_constant(lambda feature: function(a(feature)), a)
+    elif op in binary_operators:
+        function = binary_operators[op]
+        a, b = args[0], args[1]
+        return fold_constant(lambda feature: function(a(feature), b(feature)), a, b)
+    elif op == 'all':
+        def all_(feature):
+            for arg in args:
+                if not arg(feature):
                     return False
             return True
-        elif op == 'any':
-            for value in values:
-                if get_value(value):
+        return fold_constant(all_, *args)
+    elif op == 'any':
+        def any_(feature):
+            for arg in args:
+                if arg(feature):
                     return True
             return False
-        elif op == 'at':
-            if len(values) != 2:
-                raise ValueError()
-            if not isinstance(values[2], list):
-                raise TypeError()
-            return get_value(values[2][get_value(values[1], feature)], feature)
-        elif op == 'get':
-            if values[0] in feature['properties']:
-                return feature['properties'][values[0]]
-            else:
-                return 0
-        elif op == 'has':
-            if len(values) == 1:
-                return bool(values[0] in feature['properties'])
-            else:
-                raise ValueError()
-        elif op == 'literal':
-            return values[0]
-        elif op == 'to-number':
-            return int(get_value(values[0], feature))
-        elif op == 'to-string':
-            return str(get_value(values[0], feature))
-        elif op == 'match':
-            label = get_value(values[0], feature)
-            for i in range(1, len(values) - 1):
-                if isinstance(values[i], list):
-                    if label in values[i]:
-                        return get_value(values[i+1], feature)
-                else:
-                    if label == values[i]:
-                        return get_value(values[i+1], feature)
-            return get_value(values[-1], feature)
-        elif op == 'case':
-            for i in range(0, len(values) - 1, 2):
-                if get_value(values[i], feature):
-                    return get_value(values[i+1], feature)
-            return get_value(values[-1], feature)
-        elif op == 'coalesce':
-            for i in range(0, len(values)):
-                value = get_value(values[i], feature)
+        return fold_constant(any_, *args)
+    elif op == 'at':
+        if len(args) != 2:
+            raise ValueError()
+        index, array = args
+        return fold_constant(lambda feature: array(feature)[int(index(feature))], index, array)
+    elif op == 'coalesce':
+        def coalesce(feature):
+            value = None
+            for arg in args:
+                value = arg(feature)
                 if value:
                     return value
-            return get_value(values[-1], feature)
-        elif op == 'step':
-            label = get_value(values[0], feature)
-            for i in range(2, len(values) - 1, 2):
-                if values[i] > label:
-                    return get_value(values[i-1], feature)
-            return get_value(values[-1], feature)
-        elif op == 'interpolate':
-            return interpolate(values[2:], values[0], values[1], feature)
-        elif op == 'geometry-type':
-            geometry_type = feature['geometry']['type']
-            if geometry_type == 'MultiPolygon':
-                return 'Polygon'
-            elif geometry_type == 'MultiLineString':
-                return 'LineString'
-            else:
-                return geometry_type
-        else:
-            raise ValueError('Unknown Expression: "{}"'.format(op))
+            return value
+        return fold_constant(coalesce, *args)
     else:
-        return expression
+        raise ValueError('Unknown Expression: "{}"'.format(op))
+
+def compile_expression(expression, zoom):
+    # Mapbox 스타일 식을 지물(feature)을 인자로 받는 함수로 변환
+    if not isinstance(expression, list) or not expression or not isinstance(expression[0], str):
+        return Constant(expression)
+    
+    try:
+        return compile_operator(expression[0], expression[1:], zoom)
+    except Exception as e:
+        # 잘못된 식은 실제로 평가될 때 오류를 발생시킴
+        error = e
+        def raise_error(feature):
+            raise error
+        return raise_error
+
+def compile_property(name, expression, zoom):
+    if name in raw_properties:
+        return Constant(expression)
     
-def get_color(color_style, feature = None):
-    if isinstance(color_style, str):
-        return color_to_hex(color_style)
-    else:
-        return color_to_hex(get_value(color_style, feature))
+    function = compile_expression(expression, zoom)
+    
+    if name.endswith('-color'):
+        if is_constant(function):
+            return fold_constant(lambda feature: color_to_hex(function.value), function)
+        return lambda feature: color_to_hex(function(feature))
+    
+    return function
+
+def compile_layer(layer, zoom):
+    compiled = {'id': layer['id'], 'type': layer['type'], 'source-layer': layer.get('source-layer'), 'filter': None, 'paint': {}, 'layout': {}}
+    
+    if 'filter' in layer:
+        compiled['filter'] = compile_expression(layer['filter'], zoom)
+    
+    for key in ['paint', 'layout']:
+        for name, expression in layer.get(key, {}).items():
+            compiled[key][name] = compile_property(name, expression, zoom)
+    
+    return compiled
+
+def get_compiled_layers(style, zoom):
+    with style_lock:
+        if zoom not in style['compiled']:
+            style['compiled'][zoom] = [compile_layer(layer, zoom) for layer in style['layers'] if layer.get('minzoom', 0) <= zoom]
+        
+        return style['compiled'][zoom]
 
 def draw_geometry(f, feature, style):
     style_str = css_style(style)
@@ -287,14 +418,14 @@ def draw_symbol(f, feature, layout, paint):
         icon_image = None
         
         if 'icon-image' in layout:
-            icon_image = layout['icon-image']
+            icon_image = layout['icon-image'](feature)
         
         if icon_image:
-            sprite = load_sprite(get_value(icon_image, feature))
+            sprite = load_sprite(icon_image)
             size = 1
             
             if 'icon-size' in layout:
-                size = get_value(layout['icon-size'], feature)
+                size = layout['icon-size'](feature)
             
             size *= 8
             x = coord[0] - (sprite['size'][0] / 2) * size
@@ -305,27 +436,27 @@ def draw_symbol(f, feature, layout, paint):
             f.write('</g>\n')
         
         if 'text-field' in layout:
-            text = get_value(layout['text-field'], feature)
+            text = layout['text-field'](feature)
             text_style = {'fill': '#111111', 'stroke': 'none', 'text-anchor': 'middle', 'font-size': 15, 'text-align': 'center'}
             
             if 'text-font' in layout:
-                text_style['font-family'] = layout['text-font'][0]
+                text_style['font-family'] = layout['text-font'](feature)[0]
             
             if 'text-size' in layout:
-                text_style['font-size'] = get_value(layout['text-size'], feature) * 8
+                text_style['font-size'] = layout['text-size'](feature) * 8
                 text_style['stroke-width'] = text_style['font-size'] / 4
             
             if 'text-color' in paint:
-                text_style['fill'] = get_color(paint['text-color'], feature)
+                text_style['fill'] = paint['text-color'](feature)
                 
             if 'text-halo-color' in paint:
-                text_style['stroke'] = get_color(paint['text-halo-color'], feature)
+                text_style['stroke'] = paint['text-halo-color'](feature)
             
             x = coord[0]
             y = coord[1]
             
             if 'text-offset' in layout:
-                text_offset = get_value(layout['text-offset'], feature)
+                text_offset = layout['text-offset'](feature)
                 
                 x += text_offset[0] * text_style['font-size']
                 y -= text_offset[1] * text_style['font-size']
@@ -355,29 +486,128 @@ def load_sprite(sprite_id):
     else:
         raise ValueError()
 
-def load_tile(style_id, token, x, y, zoom, draw_full_svg = True, clip_mask = True, fp = None):
-    properties['x'] = x
-    properties['y'] = y
-    properties['zoom'] = zoom
+def get_style_cache_path(style_id):
+    return os.path.join(style_cache_dir, style_id.replace('/', '_') + '.json')
+
+def read_style_cache(style_id):
+    try:
+        with open(get_style_cache_path(style_id), mode='r', encoding='utf-8') as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    if not isinstance(record, dict) or record.get('version') != style_cache_version or 'style' not in record:
+        return None
+    
+    return record
+
+def write_style_cache(style_id, record):
+    if not os.path.exists(style_cache_dir):
+        os.makedirs(style_cache_dir)
+    
+    cache_path = get_style_cache_path(style_id)
+    
+    temp_path = '{}.{}.{}.tmp'.format(cache_path, os.getpid(), threading.get_ident())
+    with open(temp_path, mode='w', encoding='utf-8') as f:
+        json.dump(record, f)
+    os.replace(temp_path, cache_path)
+
+def fetch_style(style_id, token, record = None):
+    headers = {}
+    
+    # 저장된 스타일이 있으면 조건부 요청으로 변경 여부만 확인
+    if record:
+        if record.get('etag'):
+            headers['If-None-Match'] = record['etag']
+        if record.get('last_modified'):
+            headers['If-Modified-Since'] = record['last_modified']
+    
+    style_response = http_client.get(style_url.format(style_id), params = {'access_token': token}, headers = headers)
+    
+    if style_response.status_code == 304 and record:
+        record['fetched'] = time.time()
+        return record
     
-    # Load styles
-    style_response = requests.get(style_url.format(style_id), params = {'access_token': token})
     styles = style_response.json()
     
     if style_response.status_code != 200:
         if 'message' in styles:
             raise MapBoxError(styles['message'])
-    
+        raise MapBoxError('Style request failed: HTTP {}'.format(style_response.status_code))
+    
+    return {
+        'version': style_cache_version,
+        'modified': styles.get('modified'),
+        'etag': style_response.headers.get('ETag'),
+        'last_modified': style_response.headers.get('Last-Modified'),
+        'fetched': time.time(),
+        'style': styles
+    }
+
+def parse_style(styles):
     # Get tileset sources
     if re.match(r'mapbox://', styles['sources']['composite']['url']) and styles['sources']['composite']['type'] == 'vector':
-        sources = styles['sources']['composite']['url'][9:]
+        tileset = styles['sources']['composite']['url'][9:]
     else:
         raise ValueError()
     
-    # Load tilesets
-    tile_response = requests.get(tile_url.format(sources, zoom, x, y), params = {'access_token': token})
+    return {'tileset': tileset, 'modified': styles.get('modified'), 'layers': styles['layers'], 'compiled': {}}
+
+def load_style(style_id, token):
+    with style_lock:
+        if style_id not in style_cache:
+            style_cache[style_id] = parse_style(load_style_record(style_id, token)['style'])
+        
+        return style_cache[style_id]
 
-    tile = mapbox_vector_tile.decode(tile_response.content)
+def load_style_record(style_id, token):
+    record = read_style_cache(style_id)
+    
+    if record is None or time.time() - record.get('fetched', 0) > style_max_age:
+        try:
+            record = fetch_style(style_id, token, record)
+        except requests.exceptions.RequestException:
+            # 네트워크 오류 시 기한이 지난 스타일이라도 사용
+            if record is None:
+                raise
+        else:
+            write_style_cache(style_id, record)
+    
+    return record
+
+def get_tile_cache_path(tileset, x, y, zoom):
+    tileset_dir = re.sub(r'[^0-9A-Za-z._-]', '_', tileset)
+    return os.path.join(tile_cache_dir, tileset_dir, str(zoom), str(x), '{}.mvt'.format(y))
+
+def load_tile_data(tileset, token, x, y, zoom):
+    # 스타일과 무관한 원본 벡터 타일(MVT) 캐시
+    cache_path = get_tile_cache_path(tileset, x, y, zoom)
+    
+    if os.path.exists(cache_path):
+        with open(cache_path, mode='rb') as f:
+            return f.read()
+    
+    tile_response = http_client.get(tile_url.format(tileset, zoom, x, y), params = {'access_token': token})
+    
+    if tile_response.status_code != 200:
+        raise MapBoxError('Tile request failed: HTTP {} ({}/{}/{})'.format(tile_response.status_code, zoom, x, y))
+    
+    os.makedirs(os.path.dirname(cache_path), exist_ok = True)
+    
+    # 여러 작업 프로세스가 같은 타일을 동시에 받을 수 있으므로 프로세스와 스레드마다 임시 파일을 따로 씀
+    temp_path = '{}.{}.{}.tmp'.format(cache_path, os.getpid(), threading.get_ident())
+    with open(temp_path, mode='wb') as f:
+        f.write(tile_response.content)
+    os.replace(temp_path, cache_path)
+    
+    return tile_response.content
+
+def load_tile(style_id, token, x, y, zoom, draw_full_svg = True, clip_mask = True, fp = None):
+    # Load styles
+    style = load_style(style_id, token)
+    
+    # Load tilesets
+    tile = mapbox_vector_tile.decode(load_tile_data(style['tileset'], token, x, y, zoom))
     
     if fp == None:
         f = io.StringIO()
@@ -395,14 +625,13 @@ def load_tile(style_id, token, x, y, zoom, draw_full_svg = True, clip_mask = Tru
     else:
         f.write('<g id="map" transform="scale(1, -1) translate(0, -4096)">')
     
-    for layer in styles['layers']:
-        if 'minzoom' in layer:
-            if layer['minzoom'] > properties['zoom']:
-                continue
+    for layer in get_compiled_layers(style, zoom):
+        paint = layer['paint']
+        layout = layer['layout']
         
         if layer['type'] == 'background':
-            if 'background-color' in layer['paint']:
-                fill = get_color(layer['paint']['background-color'])
+            if 'background-color' in paint:
+                fill = paint['background-color'](None)
                 f.write('<g id="{0}"><rect x="0" y="0" width="4096" height="4096" fill="{1}" stroke="{1}" stroke-width="32" /></g>'.format(layer['id'], fill))
         else:
             if not layer['source-layer'] in tile:
@@ -410,58 +639,54 @@ def load_tile(style_id, token, x, y, zoom, draw_full_svg = True, clip_mask = Tru
             
             f.write('<g id="{}">'.format(layer['id']))
             source_layer = tile[layer['source-layer']]
+            layer_filter = layer['filter']
             
             for feature in source_layer['features']:
-                draw_filter = True
+                if layer_filter and not layer_filter(feature):
+                    continue
                 
-                if 'filter' in layer:
-                    draw_filter = get_value(layer['filter'], feature)
-                
-                if draw_filter:
-                    if layer['type'] == 'fill':
-                        feature_style = {'fill': '#000000', 'opacity': 1}
-                        
-                        if 'paint' in layer:
-                            if 'fill-color' in layer['paint']:
-                                feature_style['fill'] = get_color(layer['paint']['fill-color'], feature)
-                            
-                            if 'opacity' in layer['paint']:
-                                feature_style['opacity'] = get_value(layer['paint']['opacity'], feature)
+                if layer['type'] == 'fill':
+                    feature_style = {'fill': '#000000', 'opacity': 1}
+                    
+                    if 'fill-color' in paint:
+                        feature_style['fill'] = paint['fill-color'](feature)
+                    
+                    if 'opacity' in paint:
+                        feature_style['opacity'] = paint['opacity'](feature)
+                    
+                    draw_geometry(f, feature, feature_style)
+                elif layer['type'] == 'line':
+                    feature_style = {'fill': 'none', 'stroke': '#000000', 'stroke-width': 1, 'stroke-opacity': 1}
+                    
+                    if 'line-color' in paint:
+                        feature_style['stroke'] = paint['line-color'](feature)
                         
-                        draw_geometry(f, feature, feature_style)
-                    elif layer['type'] == 'line':
-                        feature_style = {'fill': 'none', 'stroke': '#000000', 'stroke-width': 1, 'stroke-opacity': 1}
+                    if 'line-width' in paint:
+                        feature_style['stroke-width'] = paint['line-width'](feature) * 8
+                    
+                    if 'line-opacity' in paint:
+                        feature_style['stroke-opacity'] = paint['line-opacity'](feature)
+                    
+                    if 'line-dasharray' in paint:
+                        line_dasharray = paint['line-dasharray'](feature)
+                        if not isinstance(line_dasharray, list):
+                            raise TypeError()
                         
-                        if 'paint' in layer:
-                            if 'line-color' in layer['paint']:
-                                feature_style['stroke'] = get_color(layer['paint']['line-color'], feature)
-                                
-                            if 'line-width' in layer['paint']:
-                                feature_style['stroke-width'] = get_value(layer['paint']['line-width'], feature) * 8
+                        dasharray_str = ''
+                        for dash in line_dasharray:
+                            dasharray_str += '{} '.format(dash)
                             
-                            if 'line-opacity' in layer['paint']:
-                                feature_style['stroke-opacity'] = get_value(layer['paint']['line-opacity'], feature)
-                            
-                            if 'line-dasharray' in layer['paint']:
-                                if not isinstance(layer['paint']['line-dasharray'], list):
-                                    raise TypeError()
-                                
-                                dasharray_str = ''
-                                for dash in layer['paint']['line-dasharray']:
-                                    dasharray_str += '{} '.format(dash)
-                                    
-                                feature_style['stroke-dasharray'] = dasharray_str
-                        
-                        if 'layout' in layer:
-                            if 'line-cap' in layer['layout']:
-                                feature_style['stroke-linecap'] = get_value(layer['layout']['line-cap'], feature)
-                                
-                            if 'line-join' in layer['layout']:
-                                feature_style['stroke-linejoin'] = get_value(layer['layout']['line-join'], feature)
+                        feature_style['stroke-dasharray'] = dasharray_str
+                    
+                    if 'line-cap' in layout:
+                        feature_style['stroke-linecap'] = layout['line-cap'](feature)
                         
-                        draw_geometry(f, feature, feature_style)
-                    elif layer['type'] == 'symbol':
-                        draw_symbol(f, feature, layer['layout'], layer['paint'])
+                    if 'line-join' in layout:
+                        feature_style['stroke-linejoin'] = layout['line-join'](feature)
+                    
+                    draw_geometry(f, feature, feature_style)
+                elif layer['type'] == 'symbol':
+                    draw_symbol(f, feature, layout, paint)
             
             f.write('</g>')
     
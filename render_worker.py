@@ -0,0 +1,209 @@
+import os, io, threading, itertools, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import routemap, bus_api, font_metrics
+
+# 미리보기 렌더링을 실행하는 작업 프로세스 수
+worker_count = max(1, min(4, (os.cpu_count() or 1) - 1))
+
+# 작업 프로세스마다 유지하는 RouteMap 수 (창별로 하나)
+route_map_cache_size = 8
+
+# 렌더링 취소에 쓰는 공유 배열의 크기 (창마다 노선도용과 배경용으로 두 칸씩 사용)
+# 빈 칸이 없으면 취소 없이 렌더링
+render_slots = 64
+
+background_styles = {
+    'light': ('kiwitree/clinp1vgh002t01q4c2366q3o', '#ffffff'),
+    'dark': ('kiwitree/clirdaqpr00hu01pu8t7vhmq7', '#282828')
+}
+
+executor = None
+executor_lock = threading.Lock()
+render_ids = itertools.count()
+
+# 렌더링 번호는 모든 창에서 계속 증가하므로, 닫힌 창의 칸을 다른 창이 받아도 그대로 사용 가능
+render_generations = itertools.count(1)
+free_slots = list(range(render_slots))
+
+# 칸별로 마지막으로 요청한 렌더링 번호 (메인 프로세스와 작업 프로세스가 공유)
+latest_generations = None
+
+# 작업 프로세스에서만 사용
+route_maps = {}
+
+class RenderCancelEvent():
+    # RouteMap.render_init에 넘기는 취소 표시
+    # 같은 칸에서 더 나중에 요청한 렌더링이 있으면 설정된 것으로 봄
+    def __init__(self, slot, generation):
+        self.slot = slot
+        self.generation = generation
+    
+    def is_set(self):
+        if self.slot == None:
+            return False
+        
+        return latest_generations[self.slot] > self.generation
+
+def init_worker(generations):
+    global latest_generations
+    latest_generations = generations
+    
+    # 배경 지도 모듈(mapbox_vector_tile)은 이 모듈을 불러올 때 함께 불러오므로
+    # 첫 렌더링이 늦어지지 않도록 글씨체 너비 표만 미리 불러옴
+    font_metrics.get_font('')
+
+def get_executor():
+    global executor, latest_generations
+    
+    with executor_lock:
+        if executor is None:
+            # Qt 스레드가 있는 프로세스를 fork하지 않도록 Windows와 같은 방식으로 작업 프로세스 시작
+            context = multiprocessing.get_context('spawn')
+            latest_generations = context.Array('q', render_slots, lock = False)
+            executor = ProcessPoolExecutor(max_workers = worker_count, mp_context = context, initializer = init_worker, initargs = (latest_generations,))
+        
+        return executor
+
+def shutdown():
+    global executor
+    
+    with executor_lock:
+        if executor is not None:
+            executor.shutdown(wait = False, cancel_futures = True)
+            executor = None
+
+def new_render_id():
+    return next(render_ids)
+
+def new_generation():
+    return next(render_generations)
+
+def acquire_slot():
+    # 창에서 사용할 취소용 칸 (남은 칸이 없으면 None)
+    with executor_lock:
+        if len(free_slots) == 0:
+            return None
+        
+        return free_slots.pop(0)
+
+def release_slot(slot):
+    # 창을 닫을 때 진행 중인 렌더링을 취소하고 칸을 돌려줌
+    if slot == None:
+        return
+    
+    cancel(slot, new_generation())
+    
+    with executor_lock:
+        free_slots.append(slot)
+
+def submit(function, request):
+    # 작업 프로세스에서 function(request)를 실행하는 Future 반환
+    return get_executor().submit(function, request)
+
+def cancel(slot, generation):
+    # 같은 칸에서 generation보다 먼저 요청한 렌더링을 모두 취소
+    if slot == None:
+        return
+    
+    get_executor()
+    latest_generations[slot] = generation
+
+def get_route_map(request):
+    # 같은 창에서 요청한 렌더링은 RouteMap을 다시 사용해 단계별 렌더링 캐시를 유지
+    bus_routemap = route_maps.pop(request['render_id'], None)
+    
+    if bus_routemap is None:
+        bus_routemap = routemap.RouteMap(request['route_info'], request['bus_stops'], request['points'])
+    
+    route_maps[request['render_id']] = bus_routemap
+    
+    while len(route_maps) > route_map_cache_size:
+        del route_maps[next(iter(route_maps))]
+    
+    return bus_routemap
+
+def render(request):
+    # 작업 프로세스에서 미리보기 창의 노선도를 렌더링
+    # 배경은 background_key로 창에서 따로 요청 (render_background)
+    bus_routemap = get_route_map(request)
+    bus_routemap.render_init(RenderCancelEvent(request['slot'], request['generation']))
+    bus_routemap.check_cancelled()
+    
+    bus_routemap.update_route_info(request['route_info'])
+    bus_routemap.is_one_way = request['is_one_way']
+    bus_routemap.theme = request['theme']
+    
+    route_size = bus_routemap.route_frame.size()
+    
+    if route_size[0] < route_size[1] / 1.5:
+        route_size = (route_size[1] / 1.5, route_size[1])
+    elif route_size[1] < route_size[0] / 1.5:
+        route_size = (route_size[0], route_size[0] / 1.5)
+    
+    size_factor_base = route_size[0] / 640
+    route_size_factor = size_factor_base * (request['size'] / 100)
+    info_size_factor = size_factor_base * (request['info_size'] / 100) * 0.75
+    circle_size_factor = size_factor_base * (request['circle_size'] / 100)
+    text_size_factor = size_factor_base * (request['text_size'] / 100)
+    min_interval = 60 * route_size_factor
+    
+    bus_stop_list = request['bus_stop_list']
+    
+    if bus_stop_list == None:
+        bus_stop_list = bus_routemap.parse_bus_stops(min_interval)
+        trans_id = bus_routemap.trans_id
+    else:
+        trans_id = request['trans_id']
+        bus_routemap.update_trans_id(trans_id)
+    
+    # 노선도 렌더링
+    svg_map = io.StringIO()
+    bus_routemap.render_path(route_size_factor, svg_map)
+    
+    # 정류장 목록 편집에서 위치를 지정한 정류장은 그대로 둠
+    if request['optimize_text']:
+        text_directions = bus_routemap.optimize_text_directions(bus_stop_list, text_size_factor, circle_size_factor)
+    else:
+        text_directions = [stop.get('text_dir', -1) for stop in bus_stop_list]
+    
+    svg_texts = bus_routemap.draw_bus_stop_texts(bus_stop_list, text_size_factor, text_directions)
+    
+    for stop, svg_text in zip(bus_stop_list, svg_texts):
+        svg_map.write(bus_routemap.draw_bus_stop_circle(stop, circle_size_factor))
+        svg_map.write(svg_text)
+    svg_map.write(bus_routemap.draw_bus_info(info_size_factor) + '\n')
+    
+    bus_routemap.mapframe.extend(size_factor_base * 30)
+    
+    mapbox_style, page_color = background_styles[request['theme']]
+    
+    # 배경은 지도 범위와 색이 바뀌었을 때만 다시 만듦
+    mapframe = bus_routemap.mapframe.copy()
+    background_key = (request['draw_background_map'], mapbox_style if request['draw_background_map'] else page_color, mapframe.left, mapframe.top, mapframe.right, mapframe.bottom)
+    
+    return {
+        'svg_map': svg_map.getvalue(),
+        'background_key': background_key,
+        'mapframe': mapframe,
+        'bus_stop_list': bus_stop_list,
+        'trans_id': trans_id
+    }
+
+def render_background(request):
+    # 작업 프로세스에서 render가 반환한 background_key의 배경을 렌더링
+    # 같은 칸에서 다른 배경을 요청하면 배경 지도 타일 사이에서 취소
+    cancel_event = RenderCancelEvent(request['slot'], request['generation'])
+    
+    def check_cancelled():
+        if cancel_event.is_set():
+            raise routemap.RenderCancelled()
+    
+    check_cancelled()
+    
+    draw_background_map, background_style = request['background_key'][:2]
+    mapframe = request['mapframe']
+    
+    if draw_background_map:
+        return bus_api.get_mapbox_map(mapframe, request['mapbox_key'], background_style, check_cancelled = check_cancelled)
+    else:
+        return '<rect x="{}" y="{}" width="{}" height="{}" style="fill:{}" />'.format(mapframe.left, mapframe.top, mapframe.width(), mapframe.height(), background_style)
@@ -0,0 +1,108 @@
+import os, re, json
+
+catalog_version = 2
+
+rx_route_number = re.compile('[0-9]+')
+
+def get_ngrams(text, n):
+    return {text[i:i+n] for i in range(len(text) - n + 1)}
+
+class RouteCatalog():
+    # 전체 노선 목록과 검색 색인
+    # - 노선번호의 숫자 부분: 접미사 트라이 (숫자 검색어는 부분 문자열 검색과 동일)
+    # - 노선명, 기종점: 1~2글자 n-gram 색인
+    # regions: 목록에 포함된 지역
+    def __init__(self, routes, synced = 0, regions = ()):
+        self.routes = routes
+        self.synced = synced
+        self.regions = list(regions)
+        
+        self.number_trie = {}
+        self.name_ngrams = {}
+        self.desc_ngrams = {}
+        
+        for i, route in enumerate(self.routes):
+            name = route['name'].lower()
+            desc = route['desc'].lower()
+            
+            for match in rx_route_number.finditer(name):
+                for start in range(len(match[0])):
+                    self.add_trie(match[0][start:], i)
+            
+            for n in [1, 2]:
+                for ngram in get_ngrams(name, n):
+                    self.name_ngrams.setdefault(ngram, set()).add(i)
+                for ngram in get_ngrams(desc, n):
+                    self.desc_ngrams.setdefault(ngram, set()).add(i)
+    
+    def __len__(self):
+        return len(self.routes)
+    
+    def add_trie(self, text, route_index):
+        node = self.number_trie
+        
+        for c in text:
+            node = node.setdefault(c, {})
+            node.setdefault(None, set()).add(route_index)
+    
+    def find_number(self, number):
+        node = self.number_trie
+        
+        for c in number:
+            if c not in node:
+                return set()
+            node = node[c]
+        
+        return node[None]
+    
+    def find_ngrams(self, ngram_index, text):
+        n = min(len(text), 2)
+        result = None
+        
+        for ngram in get_ngrams(text, n):
+            if ngram not in ngram_index:
+                return set()
+            
+            if result is None:
+                result = set(ngram_index[ngram])
+            else:
+                result &= ngram_index[ngram]
+        
+        return result or set()
+    
+    def search(self, query):
+        query = query.strip().lower()
+        
+        if not query:
+            return []
+        
+        if query.isdigit():
+            # 숫자 검색은 노선번호만 비교
+            found = self.find_number(query)
+        else:
+            found = {i for i in self.find_ngrams(self.name_ngrams, query) if query in self.routes[i]['name'].lower()}
+            found |= {i for i in self.find_ngrams(self.desc_ngrams, query) if query in self.routes[i]['desc'].lower()}
+        
+        return [self.routes[i] for i in sorted(found)]
+    
+    def save(self, path):
+        folder_path = os.path.dirname(path)
+        if folder_path and not os.path.exists(folder_path):
+            os.makedirs(folder_path, exist_ok = True)
+        
+        with open(path + '.tmp', mode='w', encoding='utf-8') as f:
+            json.dump({'version': catalog_version, 'synced': self.synced, 'regions': self.regions, 'routes': self.routes}, f, ensure_ascii = False)
+        os.replace(path + '.tmp', path)
+    
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, mode='r', encoding='utf-8') as f:
+                catalog_json = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        if catalog_json.get('version') != catalog_version:
+            return None
+        
+        return cls(catalog_json['routes'], catalog_json['synced'], catalog_json['regions'])
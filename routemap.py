@@ -1,10 +1,34 @@
 from datetime import datetime
-import requests, time, sys, os, re, math, json, base64, urllib
+import requests, time, sys, os, re, math, json, base64, urllib, random, bisect, itertools, io, functools
+import font_metrics
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 origin_tile = (3490, 1584)
 
 rx_pass_stop = re.compile('\((경유|가상)\)$')
 rx_centerstop = re.compile('\(중\)$')
+rx_station = re.compile(r'(?:(?:지하철)?[1-9]호선|신분당선|공항철도)?(.+역)(?:[1-9]호선|환승센터)?(?:[0-9]+번(출구|승강장))?$')
+rx_station_line = re.compile(r'\(.+\)역')
+rx_transfer_center = re.compile(r'(광역환승센터|환승센터|환승센타|고속터미널|잠실종합운동장)$')
+
+# 글자별 너비 (글자 크기 기준, 표에 없는 글자는 1)
+char_widths = {}
+char_widths.update((c, 0.2) for c in '.()')
+char_widths.update((c, 0.6) for c in '0123456789abcdefghijklmnopqrstuvwxyz-')
+char_widths.update((c, 0.8) for c in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+
+# 정류장을 노선 경로에 투영할 때, 같은 곳을 여러 번 지나면 가장 가까운 곳에서 이 거리 안에 있는 가장 앞 구간 선택
+stop_snap_tolerance = 3
+
+# 노선 경로 단순화 허용 오차 (size_factor 배수, 출력 기준 약 0.5px)
+path_simplify_tolerance = 0.5
+
+# 정류장 명칭 위치 최적화의 기본 시간 제한(ms)
+text_direction_time_budget = 200
 
 svg_depot_icon = '<g id="bus_depot" transform="translate(18, 18) scale(2.8, 2.8) rotate({0:.2f})"><circle style="fill:{1};fill-opacity:1;stroke:nonel" cx="0" cy="0" r="5.8" /> <path style="fill:#ffffff;fill-opacity:1;stroke:none" d="m 0,0 c -0.19263,0 -0.3856,0.073 -0.5332,0.2207 -0.2952,0.2952 -0.2952,0.7712 0,1.0664 l 1.00976,1.0097 h -4.10742 c -0.41747,0 -0.75195,0.3365 -0.75195,0.7539 0,0.4175 0.33448,0.7539 0.75195,0.7539 h 4.11719 l -1.05469,1.0547 c -0.2952,0.2952 -0.2952,0.7712 0,1.0664 0.2952,0.2952 0.77121,0.2952 1.06641,0 l 2.25586,-2.2539 c 0.0305,-0.022 0.0603,-0.049 0.0879,-0.076 0.16605,-0.1661 0.23755,-0.3876 0.21679,-0.6036 -6.2e-4,-0.01 -10e-4,-0.013 -0.002,-0.019 -0.002,-0.018 -0.005,-0.035 -0.008,-0.053 -3.9e-4,0 -0.002,0 -0.002,-0.01 -0.0347,-0.1908 -0.14003,-0.3555 -0.28907,-0.4668 l -2.22461,-2.2265 c -0.1476,-0.1476 -0.34057,-0.2207 -0.5332,-0.2207 z" transform="translate(0.6,-3)" /></g>'
 
@@ -60,6 +84,9 @@ class Mapframe():
     def center(self):
         return ((self.left + self.right) / 2, (self.top + self.bottom) / 2)
     
+    def copy(self):
+        return Mapframe(self.left, self.top, self.right, self.bottom)
+    
     @classmethod
     def from_points(cls, points):
         left = min(x for x, _ in points)
@@ -115,18 +142,55 @@ def distance_from_segment(pos, pos1, pos2):
     else:
         return distance(pos, (pos1[0] + param * (pos2[0] - pos1[0]), pos1[1] + param * (pos2[1] - pos1[1])))
 
-def find_nearest_point(pos, points):
-    min_dist = distance(points[0], pos)
-    t_point = 0
+# 좌표 배열을 한 번에 변환하는 함수
+# numpy가 있으면 배열 연산을 사용하고, 없으면 한 점씩 계산
+def convert_pos_list(positions):
+    if np is None or len(positions) == 0:
+        return [convert_pos(pos) for pos in positions]
     
-    for i in range(len(points)):
-        dist = distance(points[i], pos)
+    pos_array = np.asarray(positions, dtype = float)
+    n = 1 << 12
+    x = ((pos_array[:, 0] + 180.0) / 360.0 * n - origin_tile[0]) * 512
+    y = ((1.0 - np.arcsinh(np.tan(np.radians(pos_array[:, 1]))) / np.pi) / 2.0 * n - origin_tile[1]) * 512
+    
+    return list(zip(x.tolist(), y.tolist()))
+
+def get_segment_lengths(points):
+    if np is None or len(points) < 2:
+        return [distance(points[i], points[i+1]) for i in range(len(points) - 1)]
+    
+    point_array = np.asarray(points, dtype = float)
+    d = point_array[1:] - point_array[:-1]
+    
+    return np.sqrt(d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1]).tolist()
+
+def simplify_path(points, tolerance, keep = ()):
+    # Douglas-Peucker 알고리즘으로 경로 단순화 후 남길 꼭짓점 번호 목록 반환
+    # 처음과 끝, keep에 포함된 꼭짓점은 항상 남김
+    if len(points) < 3:
+        return list(range(len(points)))
+    
+    anchors = sorted(set(keep) | {0, len(points) - 1})
+    result = set(anchors)
+    
+    stack = [(anchors[i], anchors[i+1]) for i in range(len(anchors) - 1)]
+    while stack:
+        start, end = stack.pop()
+        
+        max_dist = 0
+        max_index = -1
+        for i in range(start + 1, end):
+            dist = distance_from_segment(points[i], points[start], points[end])
+            if dist > max_dist:
+                max_dist = dist
+                max_index = i
         
-        if min_dist > dist:
-            t_point = i
-            min_dist = dist
+        if max_dist > tolerance:
+            result.add(max_index)
+            stack.append((start, max_index))
+            stack.append((max_index, end))
     
-    return t_point
+    return sorted(result)
 
 def get_point_segment(points, start, end, dist):
     idx_prev = start
@@ -147,18 +211,25 @@ def get_point_segment(points, start, end, dist):
     return idx_prev, idx_next
     
     
+@functools.lru_cache(maxsize = 4096)
 def get_text_width(text):
-    result = 0
+    return sum(char_widths.get(c, 1) for c in text)
+
+@functools.lru_cache(maxsize = 4096)
+def get_font_text_width(text, font, font_size, fallback_size):
+    # 글씨체가 설치되어 있으면 글씨체의 글자 너비(px), 없으면 get_text_width * fallback_size
+    # 글씨체에 없는 글자는 글자별 추정 너비 사용
+    metrics = font_metrics.get_font(font)
+    if metrics is None:
+        return get_text_width(text) * fallback_size
     
-    for i in text:
-        if re.match(r'[\.\(\)]', i):
-            result += 0.2
-        elif re.match(r'[0-9a-z\-]', i):
-            result += 0.6
-        elif re.match(r'[A-Z]', i):
-            result += 0.8
+    result = 0
+    for c in text:
+        width = metrics.get_char_width(c)
+        if width is None:
+            result += char_widths.get(c, 1) * fallback_size
         else:
-            result += 1
+            result += width * font_size
     
     return result
 
@@ -177,53 +248,278 @@ def check_collision(r1, r2):
         return dx * dy
     return 0
     
-def get_collision_score(new_rect, rects, points):
-    collision = 0
-    for r in rects:
-        collision += check_collision(r, new_rect)
+class CollisionGrid():
+    # 사각형을 균일 격자에 나누어 저장하고, 새 사각형과 겹치는 면적의 합을 주변 칸만 확인해 계산
+    # collision에 이어서 추가한 순서대로 합산하므로 모든 사각형을 차례대로 확인한 것과 같은 값을 반환
+    def __init__(self, cell_size, rects = ()):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.rects = []
+        
+        for r in rects:
+            self.add(r)
+    
+    def get_cells(self, rect):
+        x1 = math.floor(rect[0] / self.cell_size)
+        y1 = math.floor(rect[1] / self.cell_size)
+        x2 = math.floor((rect[0] + rect[2]) / self.cell_size)
+        y2 = math.floor((rect[1] + rect[3]) / self.cell_size)
+        
+        return [(x, y) for x in range(x1, x2 + 1) for y in range(y1, y2 + 1)]
+    
+    def add(self, rect):
+        for cell in self.get_cells(rect):
+            self.cells.setdefault(cell, []).append(len(self.rects))
+        
+        self.rects.append(rect)
+    
+    def find(self, rect):
+        found = set()
+        for cell in self.get_cells(rect):
+            found.update(self.cells.get(cell, ()))
+        
+        return sorted(found)
+    
+    def get_score(self, new_rect, collision = 0):
+        for i in self.find(new_rect):
+            collision += check_collision(self.rects[i], new_rect)
+        
+        return collision
+
+class OccupancyGrid():
+    # 점을 cell_size 크기의 칸에 나누어 저장하고, 주변 칸만 확인해 가까운 점이 있는지 검사
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+    
+    def get_cell(self, pos):
+        return (math.floor(pos[0] / self.cell_size), math.floor(pos[1] / self.cell_size))
+    
+    def add(self, pos):
+        self.cells.setdefault(self.get_cell(pos), []).append(pos)
+    
+    def has_point_within(self, pos, dist):
+        # dist <= cell_size인 경우만 정확한 결과를 보장
+        cx, cy = self.get_cell(pos)
+        
+        for x in range(cx - 1, cx + 2):
+            for y in range(cy - 1, cy + 2):
+                for p in self.cells.get((x, y), ()):
+                    if distance(pos, p) <= dist:
+                        return True
+        
+        return False
+
+class RouteIndex():
+    # 노선 경로의 꼭짓점과 선분을 균일 격자에 나누어 저장한 공간 색인
+    # start, end로 꼭짓점 번호 범위를 지정하면 points[start:end]에 대해 검색한 것과 같은 결과를 반환
+    def __init__(self, points, cell_size = None):
+        self.points = points
+        
+        mapframe = Mapframe.from_points(points)
+        self.left = mapframe.left
+        self.top = mapframe.top
+        
+        if cell_size is None:
+            path_length = sum(get_segment_lengths(points))
+            cell_size = max(path_length / max(len(points) - 1, 1) * 2, max(mapframe.size()) / 2000, 1e-6)
+        
+        self.cell_size = cell_size
+        self.columns = int(mapframe.width() / cell_size) + 1
+        self.rows = int(mapframe.height() / cell_size) + 1
+        
+        self.point_cells = {}
+        self.segment_cells = {}
+        
+        for i, p in enumerate(points):
+            self.point_cells.setdefault(self.get_cell(p), []).append(i)
+        
+        for i in range(len(points) - 1):
+            x1, y1 = self.get_cell(points[i])
+            x2, y2 = self.get_cell(points[i+1])
+            
+            for x in range(min(x1, x2), max(x1, x2) + 1):
+                for y in range(min(y1, y2), max(y1, y2) + 1):
+                    self.segment_cells.setdefault((x, y), []).append(i)
+    
+    def get_cell(self, pos):
+        return (math.floor((pos[0] - self.left) / self.cell_size), math.floor((pos[1] - self.top) / self.cell_size))
+    
+    def iter_ring(self, cx, cy, r):
+        # 중심 칸에서 체비쇼프 거리가 r인 칸 중 격자 안에 있는 칸
+        if r == 0:
+            yield (cx, cy)
+            return
+        
+        x_min, x_max = max(cx - r, 0), min(cx + r, self.columns - 1)
+        for y in (cy - r, cy + r):
+            if 0 <= y < self.rows:
+                for x in range(x_min, x_max + 1):
+                    yield (x, y)
+        
+        y_min, y_max = max(cy - r + 1, 0), min(cy + r - 1, self.rows - 1)
+        for x in (cx - r, cx + r):
+            if 0 <= x < self.columns:
+                for y in range(y_min, y_max + 1):
+                    yield (x, y)
+    
+    def search(self, cells, pos, get_distance, max_dist):
+        # 가까운 칸부터 고리 모양으로 넓혀가며 가장 가까운 항목 검색
+        # r번째 고리까지 확인했다면 나머지 칸은 모두 r * cell_size 이상 떨어져 있음
+        cx, cy = self.get_cell(pos)
+        r_min = max(0, -cx, cx - self.columns + 1, -cy, cy - self.rows + 1)
+        r_max = max(cx, self.columns - 1 - cx, cy, self.rows - 1 - cy)
+        
+        min_dist = math.inf
+        min_index = -1
+        
+        for r in range(r_min, r_max + 1):
+            if r_min < r and (min_dist < (r - 1) * self.cell_size or max_dist < (r - 1) * self.cell_size):
+                break
+            
+            for cell in self.iter_ring(cx, cy, r):
+                for i in cells.get(cell, ()):
+                    dist = get_distance(i)
+                    
+                    if dist is not None and (dist < min_dist or (dist == min_dist and i < min_index)):
+                        min_dist = dist
+                        min_index = i
+        
+        return min_dist, min_index
+    
+    def nearest_point(self, pos, start = 0, end = None):
+        end = len(self.points) if end is None else end
+        
+        if start >= end:
+            raise IndexError('empty point range')
+        
+        def get_distance(i):
+            if start <= i < end:
+                return distance(self.points[i], pos)
+        
+        return self.search(self.point_cells, pos, get_distance, math.inf)[1]
     
-    for p in points:
-        collision += check_collision((p[0] - 2, p[1] - 2, 4, 4), new_rect)
+    def min_distance_from_points(self, pos, start = 0, end = None, max_dist = math.inf):
+        end = len(self.points) if end is None else end
+        
+        def get_distance(i):
+            if start <= i < end:
+                return distance(self.points[i], pos)
+        
+        return self.search(self.point_cells, pos, get_distance, max_dist)[0]
     
-    return collision
+    def min_distance_from_segments(self, pos, start = 0, end = None, max_dist = math.inf):
+        # max_dist를 지정하면 max_dist 이하의 거리만 정확한 값을 보장
+        end = len(self.points) if end is None else end
+        
+        if end - start == 1:
+            return distance(pos, self.points[start])
+        
+        def get_distance(i):
+            if start <= i and i + 1 < end:
+                return distance_from_segment(pos, self.points[i], self.points[i+1])
+        
+        return self.search(self.segment_cells, pos, get_distance, max_dist)[0]
+    
+    def find_segments(self, pos, start = 0, end = None, max_dist = 0):
+        # pos에서 max_dist 이내에 있는 선분 번호 목록
+        end = len(self.points) if end is None else end
+        
+        x1, y1 = self.get_cell((pos[0] - max_dist, pos[1] - max_dist))
+        x2, y2 = self.get_cell((pos[0] + max_dist, pos[1] + max_dist))
+        
+        found = set()
+        for x in range(max(x1, 0), min(x2, self.columns - 1) + 1):
+            for y in range(max(y1, 0), min(y2, self.rows - 1) + 1):
+                found.update(i for i in self.segment_cells.get((x, y), ()) if start <= i and i + 1 < end)
+        
+        return sorted(i for i in found if distance_from_segment(pos, self.points[i], self.points[i+1]) <= max_dist)
 
-def min_distance_from_points(pos, points):
-    min_dist = distance(pos, points[0])
-    for p in points:
-        dist = distance(pos, p)
-        if min_dist > dist:
-            min_dist = dist
+class LinearReference():
+    # 노선 경로를 따라 잰 거리(arc length)로 경로 위의 위치를 나타내는 모델
+    def __init__(self, points):
+        self.points = points
+        self.arc_lengths = [0] + list(itertools.accumulate(get_segment_lengths(points)))
+        self.length = self.arc_lengths[-1]
+    
+    def get_segment(self, s):
+        # s가 속한 선분 번호
+        return max(min(bisect.bisect_right(self.arc_lengths, s) - 1, len(self.points) - 2), 0)
     
-    return min_dist
+    def project(self, pos, segment):
+        # pos를 segment번째 선분에 수직으로 내린 위치
+        p1 = self.points[segment]
+        p2 = self.points[segment+1]
+        seg_len = self.arc_lengths[segment+1] - self.arc_lengths[segment]
+        
+        if seg_len == 0:
+            return self.arc_lengths[segment]
+        
+        t = ((pos[0] - p1[0]) * (p2[0] - p1[0]) + (pos[1] - p1[1]) * (p2[1] - p1[1])) / seg_len ** 2
+        
+        return self.arc_lengths[segment] + min(max(t, 0), 1) * seg_len
+    
+    def get_point(self, s):
+        if len(self.points) < 2:
+            return self.points[0]
+        
+        i = self.get_segment(s)
+        seg_len = self.arc_lengths[i+1] - self.arc_lengths[i]
+        t = min(max((s - self.arc_lengths[i]) / seg_len, 0), 1) if seg_len > 0 else 0
+        
+        return (self.points[i][0] + (self.points[i+1][0] - self.points[i][0]) * t, self.points[i][1] + (self.points[i+1][1] - self.points[i][1]) * t)
+    
+    def get_nearest_vertex(self, s):
+        if len(self.points) < 2:
+            return 0
+        
+        i = self.get_segment(s)
+        return i if s - self.arc_lengths[i] <= self.arc_lengths[i+1] - s else i + 1
+    
+    def get_direction(self, s, dist):
+        # s 앞뒤로 dist만큼 떨어진 두 점을 잇는 방향
+        p1 = self.get_point(s - dist)
+        p2 = self.get_point(s + dist)
+        
+        return (p2[0] - p1[0], p2[1] - p1[1])
 
-def min_distance_from_segments(pos, points):
-    min_dist = distance(pos, points[0])
-    for i in range(len(points) - 1):
-        dist = distance_from_segment(pos, points[i], points[i+1])
-        if min_dist > dist:
-            min_dist = dist
+def split_stop_name(name):
+    # 경유, 가상 정류장 표시는 작은 글씨로 따로 표시
+    match = rx_pass_stop.search(name)
+    if match:
+        return name[:match.start(0)], name[match.start(0):]
     
-    return min_dist
+    return name, ''
+
+def get_stops_key(bus_stops):
+    # 렌더링 결과 캐시에서 정류장 목록을 비교하기 위한 값
+    return tuple((stop['ord'], stop['name'], stop['section'], stop['pass'], stop.get('text_dir', -1), tuple(stop['pos'])) for stop in bus_stops)
 
 def get_bus_stop_name(bus_stop):
-    name_split = bus_stop['name'].split('.')
-    name = bus_stop['name']
+    return normalize_stop_name(bus_stop['name'])
+
+@functools.lru_cache(maxsize = 8192)
+def normalize_stop_name(stop_name):
+    # 노선도에 표시할 정류장명과 주요 경유지 여부
+    # 같은 정류장명이 여러 노선, 여러 번의 렌더링에서 반복되므로 결과를 저장해 둠
+    name_split = stop_name.split('.')
+    name = stop_name
     
     # 중앙차로 정류장 괄호 제거
-    match = rx_centerstop.search(bus_stop['name'])
+    match = rx_centerstop.search(stop_name)
     if match:
         name = name[:match.start(0)]
         
     for n in name_split:
         # 주요 경유지 처리
-        stn_match = re.search(r'(?:(?:지하철)?[1-9]호선|신분당선|공항철도)?(.+역)(?:[1-9]호선|환승센터)?(?:[0-9]+번(출구|승강장))?$', n)
-        center_match = re.search(r'(광역환승센터|환승센터|환승센타|고속터미널|잠실종합운동장)$', n)
+        stn_match = rx_station.search(n)
+        center_match = rx_transfer_center.search(n)
         
         if center_match:
             return n, True
         elif stn_match:
             stn_name = stn_match[1]
-            stn_name = re.sub(r'\(.+\)역', '역', stn_name)
+            stn_name = rx_station_line.sub('역', stn_name)
             
             return stn_name, True
             
@@ -282,6 +578,9 @@ def get_bus_color(route_info):
     
     return (line_color, line_dark_color)
 
+class RenderCancelled(Exception):
+    pass
+
 class RouteMap():
     def __init__(self, route_info, bus_stops, points, is_one_way = False, theme = 'light'):
         self.route_info = route_info
@@ -289,12 +588,45 @@ class RouteMap():
         self.points = points
         
         self.is_one_way = is_one_way
-        self.mapframe = Mapframe.from_points(self.points)
+        self.route_frame = Mapframe.from_points(self.points)
+        self.mapframe = self.route_frame.copy()
+        self.route_index = RouteIndex(self.points)
+        self.linear_ref = LinearReference(self.points)
+        self.stop_points = convert_pos_list([stop['pos'] for stop in self.bus_stops])
+        self.project_bus_stops()
+        self.simplified_paths = {}
+        self.render_cache = {}
+        self.cancel_event = None
+        
+        # 정류장 명칭 박스가 노선 경로를 가리는 정도를 빠르게 계산하기 위한 격자
+        self.collision_cell_size = max(max(self.mapframe.size()) / 64, 1e-6)
+        self.point_grid = CollisionGrid(self.collision_cell_size, [(p[0] - 2, p[1] - 2, 4, 4) for p in self.points])
         
         self.update_trans_id(self.get_trans_id())
-        self.line_color, self.line_dark_color = get_bus_color(self.route_info)
+        self.update_route_info(self.route_info)
         self.theme = theme
+    
+    def update_route_info(self, route_info):
+        # 노선 정보 편집에서 노선명, 기종점을 바꾼 경우
+        self.route_info = route_info
+        self.line_color, self.line_dark_color = get_bus_color(self.route_info)
 
+    def check_cancelled(self):
+        # 렌더링 도중 cancel_event가 설정되면 RenderCancelled를 발생시켜 중단
+        # 중단된 단계의 결과는 캐시에 저장하지 않음
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise RenderCancelled()
+    
+    def get_cached(self, stage, key, compute):
+        # 렌더링 단계별 결과를 입력값(key)과 함께 저장해 두고, 입력값이 바뀐 단계만 다시 계산
+        cached = self.render_cache.get(stage)
+        
+        if cached is None or cached[0] != key:
+            cached = (key, compute())
+            self.render_cache[stage] = cached
+        
+        return cached[1]
+    
     def get_trans_id(self):
         for i, stop in enumerate(self.bus_stops):
             if stop['is_trans']:
@@ -307,11 +639,69 @@ class RouteMap():
             raise ValueError()
         
         self.trans_id = new_id
-        self.t_point = find_nearest_point(convert_pos(self.bus_stops[self.trans_id]['pos']), self.points)
+        self.t_point = self.linear_ref.get_nearest_vertex(self.stop_positions[self.trans_id])
+    
+    def match_stop_segment(self, pos, start = 0, end = None):
+        # start~end 구간에서 정류장과 가장 가까운 선분 번호
+        # 허용 오차 안의 선분 중 처음으로 이어지는 구간에서 가장 가까운 선분 선택
+        min_dist = self.route_index.min_distance_from_segments(pos, start, end)
+        segments = self.route_index.find_segments(pos, start, end, min_dist + stop_snap_tolerance)
+        
+        first_pass = 1
+        while first_pass < len(segments) and segments[first_pass] == segments[first_pass - 1] + 1:
+            first_pass += 1
+        
+        return min(segments[:first_pass], key = lambda i: distance_from_segment(pos, self.points[i], self.points[i+1]))
+    
+    def project_bus_stops(self):
+        # 정류장을 순서대로 노선 경로에 투영해 경로를 따라 잰 위치 계산
+        # 앞 정류장보다 뒤쪽에서만 찾으므로 경로가 스스로 교차해도 지나는 순서대로 배치됨
+        # 다음 정류장의 회차 전/후 구간 안 위치보다, 회차 전 정류장은 회차 정류장보다 더 뒤에서 찾은 경우 (GPS 오차, 가까운 길로 돌아오는 노선 등)
+        # 검색 시작 위치는 그대로 두고, 회차 전/후 구간 안에서 가장 가까운 곳에 배치 (다음 정류장 위치를 넘지 않음)
+        self.stop_positions = []
+        
+        if len(self.points) < 2:
+            self.stop_positions = [0] * len(self.stop_points)
+            return
+        
+        trans_id = self.get_trans_id()
+        if trans_id == None:
+            trans_id = len(self.stop_points) - 1
+        
+        t_segment = self.match_stop_segment(self.stop_points[trans_id])
+        t_position = self.linear_ref.project(self.stop_points[trans_id], t_segment)
+        
+        # 회차 전/후 구간 안에서 가장 가까운 위치
+        section_positions = []
+        for i, pos in enumerate(self.stop_points):
+            if i <= trans_id:
+                section_positions.append(self.linear_ref.project(pos, self.match_stop_segment(pos, 0, t_segment + 2)))
+            else:
+                section_positions.append(self.linear_ref.project(pos, self.match_stop_segment(pos, t_segment)))
+        
+        segment = 0
+        last_position = 0
+        
+        for i, pos in enumerate(self.stop_points):
+            stop_segment = self.match_stop_segment(pos, segment)
+            position = self.linear_ref.project(pos, stop_segment)
+            
+            limit = t_position if i < trans_id else self.linear_ref.length
+            if i + 1 < len(self.stop_points):
+                limit = min(limit, section_positions[i+1])
+            
+            if position <= limit + stop_snap_tolerance:
+                segment = stop_segment
+            else:
+                position = min(section_positions[i], limit)
+            
+            last_position = max(position, last_position)
+            
+            self.stop_positions.append(last_position)
 
     def parse_bus_stops(self, min_interval):
         # 버스 정류장 렌더링
-        bus_stop_name_list = []
+        bus_stop_names = set()
         
         main_stop_list = []
         minor_stop_list = []
@@ -321,9 +711,9 @@ class RouteMap():
         # 기종점 처리
         for i in [0, last_stop_id]:
             name, is_main = get_bus_stop_name(self.bus_stops[i])
-            bus_stop_name_list.append(name)
+            bus_stop_names.add(name)
             
-            pos = convert_pos(self.bus_stops[i]['pos'])
+            pos = self.stop_points[i]
             pass_stop = bool(rx_pass_stop.search(self.bus_stops[i]['name']))
             section = 1 if i > self.trans_id else 0
             
@@ -332,43 +722,46 @@ class RouteMap():
         # 주요 정류장 처리
         for i in range(len(self.bus_stops)):
             name, is_main = get_bus_stop_name(self.bus_stops[i])
-            if not is_main or name in bus_stop_name_list:
+            if not is_main or name in bus_stop_names:
                 continue
             
-            bus_stop_name_list.append(name)
+            bus_stop_names.add(name)
             
-            pos = convert_pos(self.bus_stops[i]['pos'])
+            pos = self.stop_points[i]
             pass_stop = bool(rx_pass_stop.search(self.bus_stops[i]['name']))
             section = 1 if i > self.trans_id else 0
             
             if section == 1:
-                min_path_dist = min_distance_from_segments(pos, self.points[:self.t_point])
+                min_path_dist = self.route_index.min_distance_from_segments(pos, 0, self.t_point, min_interval / 8)
                 if min_path_dist < min_interval / 8:
                     section = 0
             
             main_stop_list.append({'ord': i, 'pos': pos, 'name': name, 'section': section, 'pass': pass_stop})
             
-        main_stop_ids = [x['ord'] for x in main_stop_list]
+        main_stop_ids = {x['ord'] for x in main_stop_list}
+        
+        # 비주요 정류장은 이미 표시한 정류장에서 min_interval보다 멀리 떨어진 경우만 표시
+        occupancy = OccupancyGrid(max(min_interval, 1e-6))
+        for stop in main_stop_list:
+            occupancy.add(stop['pos'])
     
         # 비주요 정류장 처리
         for i in range(len(self.bus_stops)):
             if i in main_stop_ids:
                 continue
             
-            pos = convert_pos(self.bus_stops[i]['pos'])
+            pos = self.stop_points[i]
             pass_stop = bool(rx_pass_stop.search(self.bus_stops[i]['name']))
             section = 1 if i > self.trans_id else 0
             
-            stop_points = [s['pos'] for s in main_stop_list + minor_stop_list]
-            min_dist = min_distance_from_points(pos, stop_points)
-            
             if i > self.trans_id:
-                min_path_dist = min_distance_from_segments(pos, self.points[:self.t_point])
+                min_path_dist = self.route_index.min_distance_from_segments(pos, 0, self.t_point, min_interval / 4)
                 if min_path_dist < min_interval / 4:
                     continue
             
-            if min_dist > min_interval:
+            if not occupancy.has_point_within(pos, min_interval):
                 minor_stop_list.append({'ord': i, 'pos': pos, 'name': self.bus_stops[i]['name'], 'section': section, 'pass': pass_stop})
+                occupancy.add(pos)
         
         return main_stop_list + minor_stop_list
 
@@ -381,8 +774,8 @@ class RouteMap():
             bus_name_main = self.route_info['name']
             bus_name_suffix = ''
             
-        bus_name_width = get_text_width(bus_name_main) * 72 + get_text_width(bus_name_suffix) * 60 + 45
-        bus_startend_width = (get_text_width(self.route_info['start']) + get_text_width(self.route_info['end'])) * 57 + 150
+        bus_name_width = get_font_text_width(bus_name_main, 'Din Medium', 85.3333, 72) + get_font_text_width(bus_name_suffix, 'Din Medium', 72, 60) + 45
+        bus_startend_width = get_font_text_width(self.route_info['start'], 'NanumSquare Bold', 64, 57) + get_font_text_width(self.route_info['end'], 'NanumSquare Bold', 64, 57) + 150
         
         bus_info_width = (bus_name_width + bus_startend_width) * size_factor
         
@@ -427,22 +820,10 @@ class RouteMap():
         
         return svg_circle
     
-    def draw_bus_stop_text(self, stop, size_factor, direction = -1):
-        style_fill_white = "fill:#ffffff;"
-        style_fill_gray = "fill:#cccccc;"
-        style_fill_yellow = "fill:#ffcc00;"
-        style_text = "font-size:30px;line-height:1.0;font-family:'KoPubDotum Bold';text-align:start;letter-spacing:0px;word-spacing:0px;fill-opacity:1;"
-        
-        section = 0 if stop['section'] == 0 or self.is_one_way else 1
-        
-        if section == 0:
-            stop_p = find_nearest_point(stop['pos'], self.points[:self.t_point])
-        else:
-            stop_p = find_nearest_point(stop['pos'], self.points[self.t_point:]) + self.t_point
-        
-        stop_p_prev, stop_p_next = get_point_segment(self.points, stop_p, stop_p, 10 * size_factor)
-        
-        path_dir = (self.points[stop_p_next][0] - self.points[stop_p_prev][0], self.points[stop_p_next][1] - self.points[stop_p_prev][1])
+    def get_text_layout(self, stop, size_factor):
+        # 정류장 명칭 박스의 후보 위치
+        # 0~3: 위, 아래, 왼쪽, 오른쪽 (경로의 법선 방향 기준), 4~7: 대각선
+        path_dir = self.linear_ref.get_direction(self.stop_positions[stop['ord']], 10 * size_factor)
         normal_dir = (path_dir[1], -path_dir[0])
         
         if normal_dir[0] == 0 and normal_dir[1] == 0:
@@ -458,15 +839,9 @@ class RouteMap():
         text_size_factor = size_factor * 0.56
         text_height = 30 * text_size_factor
         
-        match = rx_pass_stop.search(stop['name'])
-        if match:
-            stop_name_main = stop['name'][:match.start(0)]
-            stop_name_suffix = stop['name'][match.start(0):]
-        else:
-            stop_name_main = stop['name']
-            stop_name_suffix = ''
+        stop_name_main, stop_name_suffix = split_stop_name(stop['name'])
         
-        text_width = (get_text_width(stop_name_main) * 27.5 + get_text_width(stop_name_suffix) * 22 + 25)
+        text_width = get_font_text_width(stop_name_main, 'KoPubDotum Bold', 30, 27.5) + get_font_text_width(stop_name_suffix, 'KoPubDotum Bold', 24, 22) + 25
         
         text_pos_right = (stop['pos'][0] + 20 * normal_dir[0] * size_factor,  stop['pos'][1] + 20 * normal_dir[1] * size_factor - text_height / 2)
         text_rect_right = (text_pos_right[0], text_pos_right[1], text_width * text_size_factor, text_height)
@@ -483,27 +858,46 @@ class RouteMap():
         text_pos_down = (stop['pos'][0] - 20 * normal_dir[0] * size_factor - text_width * text_size_factor / 2, stop['pos'][1] - 25 * normal_dir[1] * size_factor - text_height / 2)
         text_rect_down = (text_pos_down[0], text_pos_down[1], text_width * text_size_factor, text_height)
         
-        text_pos_list = [text_pos_up, text_pos_down, text_pos_left, text_pos_right]
         text_rect_list = [text_rect_up, text_rect_down, text_rect_left, text_rect_right]
         
+        # 대각선 방향 (오른쪽 아래, 왼쪽 아래, 오른쪽 위, 왼쪽 위)
+        diagonal_offset = 14 * size_factor
+        
+        for dx, dy in [(1, 1), (-1, 1), (1, -1), (-1, -1)]:
+            text_x = stop['pos'][0] + dx * diagonal_offset - (text_width * text_size_factor if dx < 0 else 0)
+            text_y = stop['pos'][1] + dy * diagonal_offset - (text_height if dy < 0 else 0)
+            text_rect_list.append((text_x, text_y, text_width * text_size_factor, text_height))
+        
+        return path_dir, text_width, text_rect_list
+    
+    def draw_bus_stop_text(self, stop, size_factor, direction = -1):
+        style_fill_white = "fill:#ffffff;"
+        style_fill_gray = "fill:#cccccc;"
+        style_fill_yellow = "fill:#ffcc00;"
+        style_text = "font-size:30px;line-height:1.0;font-family:'KoPubDotum Bold';text-align:start;letter-spacing:0px;word-spacing:0px;fill-opacity:1;"
+        
+        section = 0 if stop['section'] == 0 or self.is_one_way else 1
+        text_size_factor = size_factor * 0.56
+        
+        stop_name_main, stop_name_suffix = split_stop_name(stop['name'])
+        path_dir, text_width, text_rect_list = self.get_text_layout(stop, size_factor)
+        
         if direction == -1:
-            collisions = [get_collision_score(x, self.text_rects, self.points) for x in text_rect_list]
+            # 자동 배치는 상하좌우 중에서만 선택
+            collisions = [self.point_grid.get_score(x, self.text_grid.get_score(x)) for x in text_rect_list[:4]]
             direction = 0
             
             for i in range(1, len(collisions)):
                 if collisions[direction] >= collisions[i]:
                     direction = i
-            
-            text_pos = text_pos_list[direction]
-            text_rect = text_rect_list[direction]
-        else:
-            if direction >= len(text_rect_list) or direction < 0:
-                raise IndexError()
-            
-            text_pos = text_pos_list[direction]
-            text_rect = text_rect_list[direction]
+        elif direction >= len(text_rect_list) or direction < 0:
+            raise IndexError()
+        
+        text_rect = text_rect_list[direction]
+        text_pos = (text_rect[0], text_rect[1])
         
         self.text_rects.append(text_rect)
+        self.text_grid.add(text_rect)
             
         stop_name_svg = stop_name_main.replace('&', '&amp;')
         if stop_name_suffix:
@@ -536,18 +930,149 @@ class RouteMap():
             
         return svg_text
     
-    def render_path(self, size_factor):
+    def optimize_text_directions(self, bus_stops, size_factor, circle_size_factor = None, time_budget = None):
+        key = (get_stops_key(bus_stops), size_factor, circle_size_factor, time_budget, self.is_one_way, self.t_point)
+        return self.get_cached('text_directions', key, lambda: self.find_text_directions(bus_stops, size_factor, circle_size_factor, time_budget))
+    
+    def find_text_directions(self, bus_stops, size_factor, circle_size_factor = None, time_budget = None):
+        # 정류장 명칭 박스끼리, 명칭 박스와 노선 경로, 명칭 박스와 정류장 원이 겹치는 면적의 합이 작아지도록 위치 선택
+        # 앞에서부터 차례대로 고른 배치에서 시작해, 시간 제한(ms) 안에서 정류장 몇 개의 위치를 무작위로 바꾼 뒤 다시 개선하는 과정을 반복
+        # text_dir이 지정된 정류장은 위치를 바꾸지 않음
+        if circle_size_factor is None:
+            circle_size_factor = size_factor
+        if time_budget is None:
+            time_budget = text_direction_time_budget
+        
+        deadline = time.perf_counter() + time_budget / 1000
+        
+        circle_radius = 6 * circle_size_factor
+        circle_grid = CollisionGrid(self.collision_cell_size, [(stop['pos'][0] - circle_radius, stop['pos'][1] - circle_radius, circle_radius * 2, circle_radius * 2) for stop in bus_stops])
+        
+        # 정류장별 후보 (방향, 박스, 경로 및 정류장 원과 겹치는 면적)
+        candidates = []
+        bounding_grid = CollisionGrid(self.collision_cell_size)
+        
+        for stop in bus_stops:
+            text_rect_list = self.get_text_layout(stop, size_factor)[2]
+            direction = stop.get('text_dir', -1)
+            
+            if direction >= 0:
+                directions = [direction]
+            else:
+                directions = range(len(text_rect_list))
+            
+            candidates.append([(d, text_rect_list[d], self.point_grid.get_score(text_rect_list[d], circle_grid.get_score(text_rect_list[d]))) for d in directions])
+            
+            bounding_frame = Mapframe.from_points([(r[0], r[1]) for r in text_rect_list] + [(r[0] + r[2], r[1] + r[3]) for r in text_rect_list])
+            bounding_grid.add((bounding_frame.left, bounding_frame.top, bounding_frame.width(), bounding_frame.height()))
+        
+        # 명칭 박스가 겹칠 수 있는 정류장 목록
+        neighbors = [[j for j in bounding_grid.find(r) if j != i] for i, r in enumerate(bounding_grid.rects)]
+        movable = [i for i in range(len(bus_stops)) if len(candidates[i]) > 1]
+        
+        def get_cost(layout, i, c):
+            cost = candidates[i][c][2]
+            for j in neighbors[i]:
+                if layout[j] >= 0:
+                    cost += check_collision(candidates[i][c][1], candidates[j][layout[j]][1])
+            return cost
+        
+        def get_total_cost(layout):
+            cost = 0
+            for i in range(len(layout)):
+                cost += candidates[i][layout[i]][2]
+                for j in neighbors[i]:
+                    if j > i:
+                        cost += check_collision(candidates[i][layout[i]][1], candidates[j][layout[j]][1])
+            return cost
+        
+        def improve(layout):
+            improved = True
+            while improved and time.perf_counter() < deadline:
+                self.check_cancelled()
+                improved = False
+                for i in movable:
+                    best_c = layout[i]
+                    best_cost = get_cost(layout, i, best_c)
+                    
+                    for c in range(len(candidates[i])):
+                        cost = get_cost(layout, i, c)
+                        if cost < best_cost:
+                            best_c = c
+                            best_cost = cost
+                    
+                    if best_c != layout[i]:
+                        layout[i] = best_c
+                        improved = True
+        
+        # 앞에서부터 차례대로 배치
+        layout = [-1] * len(bus_stops)
+        for i in range(len(bus_stops)):
+            layout[i] = min(range(len(candidates[i])), key = lambda c: get_cost(layout, i, c))
+        
+        improve(layout)
+        best_layout = layout
+        best_cost = get_total_cost(layout)
+        
+        rand = random.Random(0)
+        while movable and best_cost > 0 and time.perf_counter() < deadline:
+            self.check_cancelled()
+            layout = list(best_layout)
+            for i in rand.sample(movable, min(3, len(movable))):
+                layout[i] = rand.randrange(len(candidates[i]))
+            
+            improve(layout)
+            cost = get_total_cost(layout)
+            
+            if cost < best_cost:
+                best_layout = layout
+                best_cost = cost
+        
+        return [candidates[i][c][0] for i, c in enumerate(best_layout)]
+    
+    def get_simplified_path(self, size_factor):
+        # 출력 크기에 맞게 단순화한 경로의 꼭짓점 번호 목록
+        # 정류장과 가장 가까운 꼭짓점, 회차 지점은 남겨 정류장 배치에 영향이 없도록 함
+        tolerance = path_simplify_tolerance * size_factor
+        
+        if tolerance not in self.simplified_paths:
+            keep = [self.linear_ref.get_nearest_vertex(x) for x in self.stop_positions] + [self.t_point]
+            self.simplified_paths[tolerance] = simplify_path(self.points, tolerance, keep)
+        
+        return self.simplified_paths[tolerance]
+    
+    def render_path(self, size_factor, fp = None):
         # 노선 경로 렌더링
+        # fp를 지정하면 fp에 쓰고, 지정하지 않으면 문자열로 반환
+        svg_path = self.get_cached('path', (size_factor, self.is_one_way, self.t_point, self.line_color, self.line_dark_color), lambda: self.draw_path(size_factor))
+        
+        if fp == None:
+            return svg_path
+        
+        fp.write(svg_path)
+    
+    def draw_path(self, size_factor):
         style_path_base = "display:inline;fill:none;stroke-width:{};stroke-linecap:round;stroke-linejoin:round;stroke-miterlimit:4;stroke-dasharray:none;stroke-opacity:1".format(8 * size_factor)
         style_path = "stroke:{};".format(self.line_color) + style_path_base
         style_path_dark = "stroke:{};".format(self.line_dark_color) + style_path_base
         
         path_points = []
         
-        start_point = find_nearest_point(convert_pos(self.bus_stops[0]['pos']), self.points[:self.t_point])
-        end_point = find_nearest_point(convert_pos(self.bus_stops[-1]['pos']), self.points[self.t_point:]) + self.t_point
+        start_point = self.linear_ref.get_nearest_vertex(self.stop_positions[0])
+        end_point = self.linear_ref.get_nearest_vertex(self.stop_positions[-1])
         
-        path_points.append(self.points[start_point:self.t_point+1])
+        simplified_path = self.get_simplified_path(size_factor)
+        self.check_cancelled()
+        
+        def get_path_points(start, end):
+            # start부터 end까지의 단순화된 경로 (양 끝 포함)
+            if start >= end:
+                return [self.points[start]]
+            
+            indices = simplified_path[bisect.bisect_right(simplified_path, start):bisect.bisect_left(simplified_path, end)]
+            return [self.points[i] for i in [start] + indices + [end]]
+        
+        path_points.append(get_path_points(start_point, self.t_point))
         
         if self.route_info['type'] <= 10:
             # skip = 2
@@ -562,39 +1087,87 @@ class RouteMap():
         segment_end = -1
         
         for i in range(self.t_point, end_point):
-            min_dist = min_distance_from_segments(self.points[i], path_points[0])
+            # 돌아오는 경로 중 가는 경로에서 skip_threshold보다 멀리 떨어진 구간만 따로 그림
+            # 구간은 원래 경로의 모든 꼭짓점으로 판단하고, 그릴 때만 단순화된 경로 사용
+            min_dist = self.route_index.min_distance_from_segments(self.points[i], start_point, self.t_point + 1, skip_threshold)
             if min_dist > skip_threshold and i < end_point - 1:
                 if segment_end < 0:
                     segment_start = i
                 segment_end = i
             elif segment_end >= 0:
                 path_segment = get_point_segment(self.points, segment_start, segment_end, skip_threshold * 2)
-                path_points.append(self.points[path_segment[0]:min(path_segment[1]+1, end_point)])
+                path_points.append(get_path_points(path_segment[0], min(path_segment[1], end_point - 1)))
                 segment_end = -1
         
-        svg_path = ''
+        svg_paths = []
         
-        for i, path in enumerate(path_points):
+        # 가는 경로가 맨 위에 오도록 역순으로 씀
+        for i in range(len(path_points) - 1, -1, -1):
             if i == 0 or self.is_one_way:
                 path_style = style_path
             else:
                 path_style = style_path_dark
             
-            svg_path = make_svg_path(path_style, path) + svg_path
+            svg_paths.append(make_svg_path(path_style, path_points[i]))
+        
+        return ''.join(svg_paths)
+    
+    def draw_bus_stop_texts(self, bus_stops, size_factor, text_directions):
+        # 정류장 명칭을 모두 배치한 결과는 다음 렌더링에서 입력값이 같으면 다시 사용
+        key = (get_stops_key(bus_stops), size_factor, tuple(text_directions), tuple(self.text_rects), self.is_one_way, self.t_point, self.line_color, self.line_dark_color)
+        cached = self.render_cache.get('texts')
+        
+        if cached is None or cached[0] != key:
+            start = len(self.text_rects)
+            svg_texts = []
+            
+            for stop, direction in zip(bus_stops, text_directions):
+                self.check_cancelled()
+                svg_texts.append(self.draw_bus_stop_text(stop, size_factor, direction))
+            self.render_cache['texts'] = (key, (svg_texts, self.text_rects[start:]))
+            
+            return svg_texts
+        
+        svg_texts, text_rects = cached[1]
         
-        return svg_path
+        for text_rect in text_rects:
+            self.text_rects.append(text_rect)
+            self.text_grid.add(text_rect)
+            self.mapframe.update_rect(text_rect)
+        
+        return svg_texts
     
-    def render_init(self):
+    def render_init(self, cancel_event = None):
+        # cancel_event: 렌더링을 중간에 취소할 때 설정하는 threading.Event
+        self.cancel_event = cancel_event
+        self.mapframe = self.route_frame.copy()
         self.text_rects = []
+        self.text_grid = CollisionGrid(self.collision_cell_size)
     
-    def render(self, size_factor, min_interval):
+    def render(self, size_factor, min_interval, optimize_text = False, time_budget = None, fp = None):
+        if fp == None:
+            f = io.StringIO()
+        else:
+            f = fp
+        
         self.render_init()
-        svg = self.render_path(size_factor)
+        self.render_path(size_factor, f)
         
         bus_stops = self.parse_bus_stops(min_interval)
-        for stop in bus_stops:
-            svg += self.draw_bus_stop_circle(stop, size_factor)
-            svg += self.draw_bus_stop_text(stop, size_factor)
-        svg += self.draw_bus_info(size_factor * 0.75) + '\n'
         
-        return svg
\ No newline at end of file
+        if optimize_text:
+            text_directions = self.optimize_text_directions(bus_stops, size_factor, time_budget = time_budget)
+        else:
+            text_directions = [-1] * len(bus_stops)
+        
+        svg_texts = self.draw_bus_stop_texts(bus_stops, size_factor, text_directions)
+        
+        for stop, svg_text in zip(bus_stops, svg_texts):
+            f.write(self.draw_bus_stop_circle(stop, size_factor))
+            f.write(svg_text)
+        f.write(self.draw_bus_info(size_factor * 0.75) + '\n')
+        
+        if fp == None:
+            result = f.getvalue()
+            f.close()
+            return result
\ No newline at end of file
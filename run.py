@@ -9,8 +9,10 @@ naver_key = ''
 
 def main():
     parser = argparse.ArgumentParser(prog='bus_routemap')
-    parser.add_argument('search_query')
+    parser.add_argument('search_query', nargs='?')
     parser.add_argument('--style', choices=['light', 'dark'], default='light', required=False)
+    parser.add_argument('--optimize-text', type=int, nargs='?', const=text_direction_time_budget, metavar='MS', help='정류장명 위치를 주어진 시간(ms) 동안 최적화')
+    parser.add_argument('--sync-catalog', action='store_true', help='서울, 경기, 부산 전체 노선 목록을 받아 검색에 사용')
     
     try:
         with open('key.json', mode='r', encoding='utf-8') as key_file:
@@ -34,6 +36,17 @@ def main():
     
     args = parser.parse_args()
     
+    if args.sync_catalog:
+        print('노선 목록 동기화 중...')
+        catalog, errors = bus_api.sync_route_catalog(key)
+        for region, error in errors.items():
+            print('[{}] {}'.format(region, error))
+        if errors:
+            print('동기화하지 못한 지역이 있어 노선 목록을 저장하지 않았습니다.')
+        else:
+            print('{}개 노선 저장 완료'.format(len(catalog)))
+        return
+    
     if not args.search_query:
         query = input('검색어: ')
     else:
@@ -72,18 +85,8 @@ def main():
     
     print('노선 정보 불러오는 중...')
     try:
-        if route_data['type'] <= 10:
-            bus_stops = bus_api.get_seoul_bus_stops(key, route_data['id'])
-            route_positions = bus_api.get_seoul_bus_route(key, route_data['id'])
-            route_info = bus_api.get_seoul_bus_type(key, route_data['id'])
-        elif route_data['type'] <= 60:
-            bus_stops = bus_api.get_gyeonggi_bus_stops(key, route_data['id'])
-            route_positions = bus_api.get_gyeonggi_bus_route(key, route_data['id'])
-            route_info = bus_api.get_gyeonggi_bus_type(key, route_data['id'])
-        else:
-            route_positions, route_bims_id = bus_api.get_busan_bus_route(route_data['name'])
-            bus_stops = bus_api.get_busan_bus_stops(key, route_data['id'], route_bims_id)
-            route_info = bus_api.get_busan_bus_type(key, route_bims_id)
+        region = bus_api.convert_type_to_region(route_data['type'])
+        route_positions, route_info, bus_stops = bus_api.load_route(key, region, route_data)
     except requests.exceptions.ConnectTimeout:
         print('Request Timeout')
         return
@@ -94,10 +97,7 @@ def main():
     draw_full_svg = True
     draw_background_map = True
 
-    points = []
-
-    for pos in route_positions:
-        points.append(convert_pos(pos))
+    points = convert_pos_list(route_positions)
     
     # 일방통행 여부 묻기
     if distance(points[0], points[-1]) > 50:
@@ -120,7 +120,7 @@ def main():
     size_factor = route_size[0] / 640
     min_interval = 60 * size_factor
     
-    svg = routemap.render(size_factor, min_interval)
+    svg = routemap.render(size_factor, min_interval, optimize_text = args.optimize_text is not None, time_budget = args.optimize_text)
     
     routemap.mapframe.extend(10)
     
@@ -139,9 +139,9 @@ def main():
         
         if draw_background_map:
             if mapbox_key:
-                f.write(bus_api.get_mapbox_map(routemap.mapframe, mapbox_key, mapbox_style))
+                bus_api.get_mapbox_map(routemap.mapframe, mapbox_key, mapbox_style, f)
             elif naver_key_id and naver_key:
-                f.write(bus_api.get_naver_map(routemap.mapframe, naver_key_id, naver_key))
+                bus_api.get_naver_map(routemap.mapframe, naver_key_id, naver_key, f)
             else:
                 print('배경 지도를 사용하려면 API 키를 입력해야 합니다.')
         